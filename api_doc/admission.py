@@ -0,0 +1,126 @@
+import math
+import os
+import time
+import uuid
+
+import json_state
+
+# Share of the physical memory tool runs may be admitted into
+DEFAULT_MEM_FRACTION = 0.9
+# Margin on the learned peak RSS of a step
+RSS_MARGIN = 1.1
+# A step that kept this share of its cores busy is assumed to scale further
+SATURATED = 0.8
+
+
+def _total_mem_kb():
+    return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class AdmissionScheduler:
+    """Admits the tool runs of concurrent flows on one node by CPU and memory.
+
+    Every step (e.g. "5_2_TritonRoute") has a profile of the threads it keeps
+    busy, its peak RSS and the most cores it was ever granted, learned from
+    earlier runs' /usr/bin/time data. A step is admitted once its threads and
+    memory fit next to the running ones and gets that many NUM_CORES. Steps
+    never seen before ask for the whole node. State lives in a directory, so flows in other processes (e.g. Ray
+    Tune trials) share the same budget; grants of dead processes are dropped.
+    """
+
+    def __init__(
+        self, root: str, cpus: int = None, mem_kb: int = None, poll_s: float = 0.5
+    ) -> None:
+        self.root = root
+        self.cpus = cpus or len(os.sched_getaffinity(0))
+        self.mem_kb = mem_kb or int(_total_mem_kb() * DEFAULT_MEM_FRACTION)
+        self.poll_s = poll_s
+        os.makedirs(root, exist_ok=True)
+        self._state_path = os.path.join(root, "state.json")
+
+    def _locked(self, update):
+        return json_state.update(
+            self._state_path, update, lambda: {"grants": {}, "profiles": {}}
+        )
+
+    def demand(self, step: str, profiles=None):
+        """Cores and memory (KB) step is expected to need."""
+        if profiles is None:
+            profiles = self._locked(lambda state: state["profiles"])
+        profile = profiles.get(step)
+        if profile is None:
+            return self.cpus, 0
+        cores = min(self.cpus, max(1, math.ceil(profile["threads"])))
+        return cores, int(profile["peak_rss_kb"] * RSS_MARGIN)
+
+    def try_acquire(self, step: str):
+        """Grant step its cores and memory if they are free now, else return None."""
+
+        def update(state):
+            grants = {gid: g for gid, g in state["grants"].items() if _alive(g["pid"])}
+            state["grants"] = grants
+            cores, mem_kb = self.demand(step, state["profiles"])
+            busy_cores = sum(g["cores"] for g in grants.values())
+            busy_mem = sum(g["mem_kb"] for g in grants.values())
+            # an idle node admits anything, so oversized steps still run alone
+            if grants and (
+                busy_cores + cores > self.cpus or busy_mem + mem_kb > self.mem_kb
+            ):
+                return None
+            gid = uuid.uuid4().hex
+            grants[gid] = {
+                "pid": os.getpid(),
+                "step": step,
+                "cores": cores,
+                "mem_kb": mem_kb,
+            }
+            return {"id": gid, "step": step, "cores": cores}
+
+        return self._locked(update)
+
+    def acquire(self, step: str):
+        """Block until step is admitted. The grant's "cores" is its NUM_CORES."""
+        while True:
+            grant = self.try_acquire(step)
+            if grant is not None:
+                return grant
+            time.sleep(self.poll_s)
+
+    def release(self, grant, record=None) -> None:
+        """Give the grant back and learn the step's profile from its step record."""
+
+        def update(state):
+            state["grants"].pop(grant["id"], None)
+            if record is None or record.get("user_s") is None:
+                return
+            wall = max(record["wall_s"], 1e-3)
+            threads = (record["user_s"] + record["sys_s"]) / wall
+            profile = state["profiles"].get(grant["step"], {"peak_rss_kb": 0})
+            most_cores = profile.get("most_cores", 0)
+            # it used all it got and never got more; let it ask for the whole
+            # node next time. A step that was given more before and used only
+            # this many keeps its measured threads, and a single core is kept
+            # busy by serial steps too, so proves nothing
+            if (
+                grant["cores"] > 1
+                and grant["cores"] >= most_cores
+                and threads >= SATURATED * grant["cores"]
+            ):
+                threads = self.cpus
+            state["profiles"][grant["step"]] = {
+                "threads": max(1.0, threads),
+                "peak_rss_kb": max(profile["peak_rss_kb"], record["peak_rss_kb"]),
+                "most_cores": max(most_cores, grant["cores"]),
+            }
+
+        self._locked(update)
@@ -0,0 +1,61 @@
+import fcntl
+import os
+import shutil
+
+# ioctl that clones a file's extents (btrfs, xfs, ...), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+# Ways of publishing an artifact, cheapest first. Symlinks are left out by
+# default because the published file breaks when its source is removed.
+DEFAULT_MODES = ("reflink", "hardlink", "copy")
+
+
+def _reflink(src: str, dst: str) -> None:
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.unlink(dst)
+            raise
+
+
+def _symlink(src: str, dst: str) -> None:
+    os.symlink(os.path.abspath(src), dst)
+
+
+_PUBLISH = {
+    "reflink": _reflink,
+    "hardlink": os.link,
+    "symlink": _symlink,
+    "copy": shutil.copyfile,
+}
+
+
+def publish(src: str, dst: str, modes=DEFAULT_MODES) -> str:
+    """Make dst hold the content of src without copying it where possible.
+    The first of modes the filesystem supports is used; "copy" always works.
+    dst is unlinked first, so a file that shares its inode with another one is
+    never written through. Returns the mode used.
+    """
+
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    for mode in modes:
+        try:
+            _PUBLISH[mode](src, dst)
+            return mode
+        except OSError:
+            if mode == modes[-1]:
+                raise
+    raise ValueError(f"no publish mode in {modes}")
+
+
+def unlink_outputs(paths) -> None:
+    """Remove earlier outputs before a tool rewrites them, so the tool creates
+    new files instead of truncating inodes shared with cached artifacts.
+    """
+
+    for path in paths:
+        if os.path.lexists(path):
+            os.unlink(path)
@@ -0,0 +1,346 @@
+"""Score model-generated ChatEDA-Bench scripts on the openroad_api stub.
+
+    python bench_eval.py responses.json [more.json ...] [--jobs N] [--timeout S]
+                         [--cache scripts.db] [--out results.json]
+
+A responses file holds a model's answers to the 50 ChatEDA-Bench tasks: a
+JSON list in task order of strings or of {"id", "output"} objects, or a
+dict from task id to string. The last ```python block of an answer is its
+script (the whole answer if it has none). Scripts run in a process pool
+against openroad_api_trace, which records the stages they call and the
+arguments they pass; tune() runs its function at the bounds of every
+parameter. Each trace is checked against data/test/ChatEDA-Bench-expected.json:
+    runs       -- the script finished without an exception or timeout
+    order      -- every stage and get_metric() followed the stages it needs
+    design, platform, last_stage, args, swept, fixed, tune, metrics
+               -- see check()
+Traces are cached by the SHA-256 of the script ($CHATEDA_BENCH_CACHE or
+--cache), so re-evaluating checkpoints that repeat answers runs only the new
+ones. Scripts are model output and run unsandboxed, each in a temporary
+working directory; run this in a throwaway environment.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import re
+import signal
+import sqlite3
+import sys
+import tempfile
+import traceback
+
+import openroad_api_trace
+
+EXPECTED = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "data",
+    "test",
+    "ChatEDA-Bench-expected.json",
+)
+# Bump when a change to openroad_api_trace makes cached traces stale
+TRACE_VERSION = 1
+CODE_BLOCK = re.compile(r"```(?:python|py)?[ \t]*\n(.*?)```", re.S)
+
+
+class Timeout(BaseException):
+    """Raised into a script that outlives its time limit; not an Exception so
+    the script's own `except Exception` can't swallow it."""
+
+
+def extract_script(answer: str) -> str:
+    blocks = CODE_BLOCK.findall(answer)
+    return blocks[-1] if blocks else answer
+
+
+def script_hash(script: str) -> str:
+    return hashlib.sha256(f"{TRACE_VERSION}\0{script}".encode()).hexdigest()
+
+
+def _alarm(signum, frame):
+    # fire again shortly in case a bare `except:` swallowed this one
+    signal.setitimer(signal.ITIMER_REAL, 0.1)
+    raise Timeout()
+
+
+def run_script(script: str, timeout: float) -> dict:
+    """Execute script against the recording stub and return its trace as JSON,
+    with "error" set to the exception that ended the script, if any.
+    """
+
+    openroad_api_trace.install()
+    # the API is in scope as in the prompts, whether or not the script imports it
+    globals_ = {
+        "__name__": "__main__",
+        "chateda": openroad_api_trace.chateda,
+        "tune": openroad_api_trace.tune,
+    }
+    error = None
+    cwd = os.getcwd()
+    old = signal.signal(signal.SIGALRM, _alarm)
+    with tempfile.TemporaryDirectory(prefix="chateda-bench-") as work:
+        os.chdir(work)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+                io.StringIO()
+            ):
+                exec(compile(script, "<script>", "exec"), globals_)
+        except openroad_api_trace.Truncated:
+            pass
+        except Timeout:
+            error = "timeout"
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                error = f"SystemExit: {e.code}"
+        except BaseException as e:
+            error = "".join(traceback.format_exception_only(type(e), e)).strip()
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, old)
+            os.chdir(cwd)
+    result = openroad_api_trace.trace().to_json()
+    result["error"] = error
+    return result
+
+
+def _worker_init() -> None:
+    # scripts that read input() get EOF instead of blocking
+    sys.stdin = io.StringIO()
+
+
+class TraceCache:
+    """SQLite cache of script traces by script_hash()."""
+
+    def __init__(self, path: str) -> None:
+        self._db = sqlite3.connect(path, timeout=60)
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS traces (hash TEXT PRIMARY KEY, trace TEXT)"
+            )
+
+    def get(self, key: str):
+        row = self._db.execute(
+            "SELECT trace FROM traces WHERE hash=?", (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, trace: dict) -> None:
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO traces VALUES (?, ?)", (key, json.dumps(trace))
+            )
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def run_scripts(scripts, jobs: int = None, timeout: float = 10, cache=None) -> list:
+    """Traces of many scripts, run in a process pool and looked up in cache first.
+    Keyword parameters:
+        scripts(list(str)) -- The scripts; duplicates run once.
+        jobs(int) -- Number of worker processes. Defaults to the CPU count.
+        timeout(float) -- Seconds a script may run.
+        cache(TraceCache) -- Cache of traces; timeouts aren't cached, since a busy machine may cause them.
+    """
+
+    traces = {}
+    todo = []
+    for script in scripts:
+        key = script_hash(script)
+        if key in traces or key in todo:
+            continue
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            traces[key] = cached
+        else:
+            traces[key] = None
+            todo.append(key)
+
+    if todo:
+        by_key = {script_hash(s): s for s in scripts}
+        # a fresh interpreter per worker: scripts may leave modules patched
+        pool = multiprocessing.get_context("spawn").Pool(
+            jobs or os.cpu_count(), initializer=_worker_init, maxtasksperchild=64
+        )
+        try:
+            pending = {
+                key: pool.apply_async(run_script, (by_key[key], timeout))
+                for key in todo
+            }
+            for key, result in pending.items():
+                try:
+                    # a script stuck outside Python code never sees its alarm
+                    traces[key] = result.get(timeout + 30)
+                except multiprocessing.TimeoutError:
+                    traces[key] = {"error": "timeout"}
+                except Exception as e:
+                    traces[key] = {"error": f"worker failed: {e!r}"}
+                if cache is not None and traces[key].get("error") != "timeout":
+                    cache.put(key, traces[key])
+        finally:
+            pool.terminate()
+            pool.join()
+    return [traces[script_hash(s)] for s in scripts]
+
+
+def _same(a, b) -> bool:
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+    return a == b
+
+
+def _design(name):
+    if not isinstance(name, str):
+        return name
+    name = name.strip().lower()
+    return name[:-2] if name.endswith(".v") else name
+
+
+def _matches(pattern: str, key: str) -> bool:
+    if pattern.endswith(".*"):
+        return key.startswith(pattern[:-1])
+    return key == pattern
+
+
+def check(trace: dict, expected: dict) -> dict:
+    """Checks of a trace against the expected flow of its task; None fields of
+    expected aren't checked.
+        design, platform -- every setup() was for the expected design/platform,
+            compared case-insensitively and without a .v suffix
+        last_stage -- the furthest stage any flow reached
+        args       -- every "stage.param" was passed the expected value at least once
+        swept      -- every "stage.param" took several values ("stage.*": any param of stage)
+        fixed      -- no "stage.param" listed took more than one value
+        tune       -- tune() was (true) or wasn't (false) called
+        metrics    -- get_metric() asked for every expected metric at metric_stage (any stage if None)
+    """
+
+    if trace.get("calls") is None:
+        return {"runs": False}
+    values = trace["values"]
+    swept = {k for k, v in values.items() if len([x for x in v if x is not None]) > 1}
+    checks = {
+        "runs": trace["error"] is None,
+        "order": not trace["errors"],
+    }
+    if expected.get("design") is not None:
+        designs = {_design(d) for d in values.get("setup.design_name", [])}
+        checks["design"] = designs == {expected["design"]}
+    if expected.get("platform") is not None:
+        platforms = {_design(p) for p in values.get("setup.platform", [])}
+        checks["platform"] = platforms == {expected["platform"]}
+    if expected.get("last_stage") is not None:
+        checks["last_stage"] = trace["last_stage"] == expected["last_stage"]
+    if expected.get("args"):
+        checks["args"] = all(
+            any(_same(v, value) for v in values.get(key, []))
+            for key, value in expected["args"].items()
+        )
+    if expected.get("swept"):
+        checks["swept"] = all(
+            any(_matches(pattern, k) for k in swept) for pattern in expected["swept"]
+        )
+    if expected.get("fixed"):
+        checks["fixed"] = not any(
+            _matches(pattern, k) for pattern in expected["fixed"] for k in swept
+        )
+    if expected.get("tune") is not None:
+        checks["tune"] = (trace["tune_calls"] > 0) == expected["tune"]
+    if expected.get("metrics"):
+        stage = expected.get("metric_stage")
+        asked = set()
+        for s, names in trace["metrics"].items():
+            if stage is None or s == stage:
+                asked.update(names)
+        checks["metrics"] = set(expected["metrics"]) <= asked
+    return checks
+
+
+def load_answers(path: str) -> dict:
+    """Answers of a responses file by task id."""
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        items = [(int(k), v) for k, v in data.items()]
+    else:
+        items = []
+        for i, answer in enumerate(data, 1):
+            if isinstance(answer, dict):
+                items.append((int(answer.get("id", i)), answer["output"]))
+            else:
+                items.append((i, answer))
+    return {i: answer if isinstance(answer, str) else "" for i, answer in items}
+
+
+def evaluate(answers: dict, expected, jobs=None, timeout=10, cache=None) -> dict:
+    """Score answers (task id -> model answer) against the expected flows.
+    Return:
+        {"tasks": {id: {"checks", "score", "passed", "error", "errors"}},
+         "passed" -- tasks passing every check, "accuracy", "mean_score"}
+    Tasks without an answer score 0.
+    """
+
+    ids = [e["id"] for e in expected]
+    scripts = [extract_script(answers.get(i, "")) for i in ids]
+    traces = run_scripts(scripts, jobs=jobs, timeout=timeout, cache=cache)
+    tasks = {}
+    for e, trace in zip(expected, traces):
+        checks = check(trace, e) if e["id"] in answers else {"runs": False}
+        tasks[e["id"]] = {
+            "checks": checks,
+            "score": sum(checks.values()) / len(checks),
+            "passed": all(checks.values()),
+            "error": trace.get("error"),
+            "errors": trace.get("errors", []),
+        }
+    passed = sum(t["passed"] for t in tasks.values())
+    return {
+        "tasks": tasks,
+        "passed": passed,
+        "accuracy": passed / len(tasks),
+        "mean_score": sum(t["score"] for t in tasks.values()) / len(tasks),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("responses", nargs="+", help="Responses files, e.g. one per checkpoint")
+    parser.add_argument("--expected", default=EXPECTED)
+    parser.add_argument("--jobs", type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument("--timeout", type=float, default=10, help="Seconds per script")
+    parser.add_argument("--cache", default=os.environ.get("CHATEDA_BENCH_CACHE"))
+    parser.add_argument("--out", help="Write the per-task results as JSON to this file")
+    args = parser.parse_args()
+
+    with open(args.expected) as f:
+        expected = json.load(f)
+    cache = TraceCache(args.cache) if args.cache else None
+    results = {}
+    try:
+        for path in args.responses:
+            results[path] = evaluate(
+                load_answers(path), expected, args.jobs, args.timeout, cache
+            )
+            r = results[path]
+            print(
+                f"{path}: {r['passed']}/{len(r['tasks'])} passed, "
+                f"mean score {r['mean_score']:.3f}"
+            )
+    finally:
+        if cache is not None:
+            cache.close()
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""Orchestration overhead benchmarks of chateda on the fake_eda backend.
+
+    python bench_overhead.py [--work DIR] [--out results.json] [--tune]
+                             [--max-import-s SECONDS]
+
+Measures, without yosys/openroad:
+    import     -- cold start of a new interpreter: import openroad_api_impl, then
+                  chateda() + setup() + run_synthesis(), and the heavy modules loaded
+    setup      -- chateda() + setup() latency, cold (no parse/dont_use caches) and warm
+    stages     -- per-stage time spent in Python around the tool runs
+    log_memory -- peak Python memory of a step with a large log, buffered and streamed
+    throughput -- flows per second with 1, 2, 4, ... flows running concurrently
+    tune       -- tuned() trials per second at several max_concurrent (needs Ray)
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import fake_eda
+import openroad_api_impl
+import parse_mk_config
+
+# Modules a flow that doesn't call tuned() must not import
+HEAVY_MODULES = ("ray", "optuna", "numpy")
+
+# Run in a new interpreter by bench_import; argv[1] is the flow root
+_COLD_START = """
+import json, os, sys, time
+
+start = time.perf_counter()
+import openroad_api_impl
+imported = time.perf_counter()
+import fake_eda
+
+ceda = openroad_api_impl.chateda(on_output=lambda line: None)
+fake_eda.install(ceda)
+ceda.env.update(FLOW_VARIANT="cold_start", FAKE_EDA_LATENCY="0")
+ceda.setup("gcd", "nangate45", flow_home=sys.argv[1])
+ceda.run_synthesis()
+json.dump(
+    {
+        "import_s": imported - start,
+        "flow_s": time.perf_counter() - imported,
+        "heavy_modules": [m for m in %r if m in sys.modules],
+    },
+    sys.stderr,
+)
+"""
+
+STAGES = [
+    ("run_synthesis", {}),
+    ("floorplan", {"core_utilization": 50}),
+    ("placement", {"density": 0.6}),
+    ("cts", {}),
+    ("global_route", {}),
+    ("detail_route", {}),
+    ("density_fill", {}),
+    ("final_report", {}),
+]
+
+
+def _flow(root, variant="base", **kwargs):
+    ceda = openroad_api_impl.chateda(on_output=lambda line: None, **kwargs)
+    fake_eda.install(ceda)
+    ceda.env["FLOW_VARIANT"] = variant
+    ceda.env["CHATEDA_METRICS_DB"] = os.path.join(root, f"metrics-{variant}.db")
+    ceda.setup("gcd", "nangate45", flow_home=root)
+    return ceda
+
+
+def bench_import(root, repeat):
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([here, env.get("PYTHONPATH", "")])
+    runs = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-c", _COLD_START % (HEAVY_MODULES,), root],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        runs.append(json.loads(proc.stderr.strip().splitlines()[-1]))
+    return {
+        "import_s": statistics.median(r["import_s"] for r in runs),
+        "flow_s": statistics.median(r["flow_s"] for r in runs),
+        "heavy_modules": sorted({m for r in runs for m in r["heavy_modules"]}),
+    }
+
+
+def bench_setup(root, repeat):
+    cold, warm = [], []
+    for _ in range(repeat):
+        parse_mk_config._cache.clear()
+        shutil.rmtree(os.path.join(root, "objects"), ignore_errors=True)
+        start = time.perf_counter()
+        _flow(root)
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        _flow(root)
+        warm.append(time.perf_counter() - start)
+    return {"cold_s": statistics.median(cold), "warm_s": statistics.median(warm)}
+
+
+def bench_stages(root, repeat):
+    """Python-side time of every stage: its wall time minus its tool runs."""
+    overhead = {name: [] for name, _ in STAGES}
+    for i in range(repeat):
+        ceda = _flow(root, f"stages_{i}")
+        ceda.env.update(FAKE_EDA_LATENCY="0", FAKE_EDA_LOG_LINES="10")
+        # time tool runs as chateda sees them, process start-up included
+        ceda.env.pop("FAKE_EDA_TIME", None)
+        for name, kwargs in STAGES:
+            records = len(ceda.step_records)
+            start = time.perf_counter()
+            getattr(ceda, name)(**kwargs)
+            wall = time.perf_counter() - start
+            tools = sum(r["wall_s"] for r in ceda.step_records[records:])
+            overhead[name].append(wall - tools)
+    return {name: statistics.median(v) for name, v in overhead.items()}
+
+
+def bench_log_memory(root, lines, line_bytes):
+    result = {"log_mb": lines * line_bytes / 2**20}
+    for stream in (False, True):
+        ceda = _flow(root, f"log_{stream}", stream=stream)
+        ceda.env.update(
+            FAKE_EDA_LATENCY="0",
+            FAKE_EDA_LOG_LINES=str(lines),
+            FAKE_EDA_LINE_BYTES=str(line_bytes),
+        )
+        ceda.run_synthesis()
+        tracemalloc.start()
+        ceda.floorplan()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["streamed_peak_mb" if stream else "buffered_peak_mb"] = peak / 2**20
+    return result
+
+
+def _run_flow(root, variant, latency, results):
+    ceda = _flow(root, variant)
+    ceda.env["FAKE_EDA_LATENCY"] = str(latency)
+    for name, kwargs in STAGES[:5]:
+        getattr(ceda, name)(**kwargs)
+    results.append(ceda.get_metric("cts", "wns"))
+
+
+def bench_throughput(root, flows, concurrency, latency):
+    result = {}
+    for workers in concurrency:
+        results, threads = [], []
+        start = time.perf_counter()
+        for i in range(flows):
+            threads.append(
+                threading.Thread(
+                    target=_run_flow,
+                    args=(root, f"tp{workers}_{i}", latency, results),
+                )
+            )
+        for batch in range(0, flows, workers):
+            for t in threads[batch : batch + workers]:
+                t.start()
+            for t in threads[batch : batch + workers]:
+                t.join()
+        elapsed = time.perf_counter() - start
+        result[workers] = {"flows_per_s": len(results) / elapsed, "elapsed_s": elapsed}
+    return result
+
+
+def _tune_trial(config):
+    from ray.air import session
+
+    root = os.environ["BENCH_FLOW_ROOT"]
+    ceda = _flow(root, os.environ["FLOW_VARIANT"])
+    ceda.floorplan(core_utilization=config["util"])
+    ceda.placement(density=config["density"])
+    session.report(
+        {
+            "area": ceda.get_metric("place", "area"),
+            "power": ceda.get_metric("place", "power"),
+        }
+    )
+
+
+def bench_tune(root, samples, concurrency):
+    # trials run in Ray workers, which import this module and the flow's
+    os.environ["BENCH_FLOW_ROOT"] = root
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.abspath(__file__)), os.environ.get("PYTHONPATH", "")]
+    )
+    _flow(root).run_synthesis()
+    param = {
+        "util": {"minmax": [40, 70], "step": 10},
+        "density": {"minmax": [0.5, 0.8], "step": 0.1},
+    }
+    result = {}
+    for workers in concurrency:
+        start = time.perf_counter()
+        openroad_api_impl.tuned(
+            _tune_trial, param, num_samples=samples, max_concurrent=workers
+        )
+        elapsed = time.perf_counter() - start
+        result[workers] = {"trials_per_s": samples / elapsed, "elapsed_s": elapsed}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--work", help="Directory of the fake flow tree")
+    parser.add_argument("--out", help="Write the results as JSON to this file")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--flows", type=int, default=16)
+    parser.add_argument("--concurrency", default="1,2,4,8")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--log-lines", type=int, default=200000)
+    parser.add_argument("--line-bytes", type=int, default=100)
+    parser.add_argument("--tune", action="store_true", help="Also benchmark tuned()")
+    parser.add_argument("--tune-samples", type=int, default=8)
+    parser.add_argument(
+        "--max-import-s",
+        type=float,
+        help="Fail if the cold import takes longer or loads any of HEAVY_MODULES",
+    )
+    args = parser.parse_args()
+
+    work = args.work or tempfile.mkdtemp(prefix="chateda-bench-")
+    root = fake_eda.make_flow(os.path.join(os.path.abspath(work), "flow"))
+    concurrency = [int(c) for c in args.concurrency.split(",")]
+    # keep the flows' progress output out of the results
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = {
+            "import": bench_import(root, args.repeat),
+            "setup": bench_setup(root, args.repeat),
+            "stages": bench_stages(root, args.repeat),
+            "log_memory": bench_log_memory(root, args.log_lines, args.line_bytes),
+            "throughput": bench_throughput(root, args.flows, concurrency, args.latency),
+        }
+        if args.tune:
+            results["tune"] = bench_tune(root, args.tune_samples, concurrency)
+
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    cold = results["import"]
+    if args.max_import_s is not None and (
+        cold["import_s"] > args.max_import_s or cold["heavy_modules"]
+    ):
+        sys.exit(
+            f"cold start regressed: import took {cold['import_s']:.3f}s "
+            f"(limit {args.max_import_s}s), heavy modules {cold['heavy_modules']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
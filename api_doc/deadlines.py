@@ -0,0 +1,130 @@
+import math
+import os
+import signal
+import threading
+import time
+
+import json_state
+
+# Exit status of a tool run killed at its stage's deadline, as timeout(1) uses
+TIMEOUT_STATUS = 124
+# Exit status of a tool run killed over its stage's memory limit
+MEMORY_STATUS = 125
+LIMIT_STATUSES = {"timeout": TIMEOUT_STATUS, "memory": MEMORY_STATUS}
+# Time a killed tool gets between SIGTERM and SIGKILL to flush its logs
+KILL_GRACE_S = 5.0
+# Adaptive deadlines: ADAPTIVE_FACTOR times the QUANTILE of the tool run times of
+# the last HISTORY successful runs of a stage, once it ran MIN_RUNS times
+ADAPTIVE_FACTOR = 3.0
+QUANTILE = 0.9
+HISTORY = 50
+MIN_RUNS = 5
+MIN_DEADLINE_S = 60.0
+
+
+class StageLimitExceeded(Exception):
+    """A tool run of a tuned() trial was killed at its stage's time or memory limit."""
+
+    def __init__(self, stage: str, step: str, reason: str) -> None:
+        super().__init__(f"{step} of stage {stage} killed over its {reason} limit")
+        self.stage = stage
+        self.step = step
+        self.reason = reason
+
+
+def group_rss_kb(pgid: int) -> int:
+    """Resident memory (KB) of all processes of a process group, from /proc."""
+    page_kb = os.sysconf("SC_PAGE_SIZE") // 1024
+    total = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # fields after the command name: state, ppid, pgrp, ..., rss (22nd)
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[2]) == pgid:
+            total += int(fields[21]) * page_kb
+    return total
+
+
+class Watchdog:
+    """Kill a process group once it runs past deadline (a time.time()) or its
+    resident memory exceeds mem_kb; reason is then "timeout" or "memory".
+    The group gets SIGTERM, and SIGKILL if it outlives KILL_GRACE_S.
+    """
+
+    def __init__(
+        self, pgid: int, deadline: float = None, mem_kb: int = None, poll_s=1.0
+    ) -> None:
+        self.pgid = pgid
+        self.deadline = deadline
+        self.mem_kb = mem_kb
+        self.poll_s = poll_s
+        self.reason = None
+        self._done = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.deadline is not None or self.mem_kb is not None:
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _watch(self) -> None:
+        while True:
+            wait = self.poll_s
+            if self.deadline is not None:
+                wait = min(wait, max(0.0, self.deadline - time.time()))
+            if self._done.wait(wait):
+                return
+            if self.deadline is not None and time.time() >= self.deadline:
+                self.reason = "timeout"
+            elif self.mem_kb is not None and group_rss_kb(self.pgid) > self.mem_kb:
+                self.reason = "memory"
+            else:
+                continue
+            for sig in (signal.SIGTERM, signal.SIGKILL):
+                try:
+                    os.killpg(self.pgid, sig)
+                except ProcessLookupError:
+                    return
+                if self._done.wait(KILL_GRACE_S):
+                    return
+            return
+
+
+class StageHistory:
+    """Tool run times of the successful runs of every stage, from which stages
+    without a fixed limit get adaptive deadlines. State lives in a directory,
+    so concurrent flows (e.g. Ray Tune trials) learn from each other.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._state_path = os.path.join(root, "stages.json")
+
+    def _locked(self, update):
+        return json_state.update(self._state_path, update, dict)
+
+    def record(self, key: str, wall_s: float) -> None:
+        def update(state):
+            state[key] = (state.get(key, []) + [wall_s])[-HISTORY:]
+
+        self._locked(update)
+
+    def deadline_s(self, key: str):
+        """Adaptive deadline (s) of the stage key; None while it has too few runs."""
+        walls = sorted(self._locked(lambda state: state.get(key, [])))
+        if len(walls) < MIN_RUNS:
+            return None
+        quantile = walls[max(0, math.ceil(QUANTILE * len(walls)) - 1)]
+        return max(MIN_DEADLINE_S, ADAPTIVE_FACTOR * quantile)
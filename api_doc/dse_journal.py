@@ -0,0 +1,104 @@
+import fcntl
+import json
+import os
+
+# Journal file name inside the sweep directory given to tuned(journal=...)
+JOURNAL_FILE = "trials.jsonl"
+
+
+class Journal:
+    """Append-only JSON-lines journal of a design space exploration sweep.
+
+    Trials are keyed by their FLOW_VARIANT. Every line is one event:
+        {"event": "trial", "variant", "trial", "run", "config"} -- a trial started
+            in the tuned() call run
+        {"event": "stage", "variant", "stage", "key", "dirs", "files"} -- a stage
+            finished; key is its stage_cache.stage_key(), files its outputs
+        {"event": "report", "variant", "result"} -- a result reported to Ray Tune
+    Lines are flushed to disk as they are written, so a crashed sweep loses at
+    most the step that was running. Many processes can append to one journal.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def append(self, event) -> None:
+        line = json.dumps(event, default=float) + "\n"
+        with open(self.path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def trials(self) -> dict:
+        """State of every journaled trial, by FLOW_VARIANT:
+        {"config", "trial", "run", "stages": {stage: event}, "reports": [result, ...]}.
+        """
+
+        try:
+            f = open(self.path)
+        except FileNotFoundError:
+            return {}
+        with f:
+            return _read(f)
+
+    def claim(self, variant: str, config, trial: str, run: str):
+        """Record the start of a trial and return the FLOW_VARIANT it continues.
+        A trial Ray Tune restored keeps its variant. A new trial whose config
+        equals that of a journaled trial no trial of this run continues yet
+        takes over its variant, so its finished stages aren't rerun. Returns
+        (variant, journaled state of the variant or None).
+        """
+
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            trials = _read(f)
+            if variant not in trials:
+                for v, t in trials.items():
+                    if t["config"] == config and t["run"] != run:
+                        variant = v
+                        break
+            event = {
+                "event": "trial",
+                "variant": variant,
+                "trial": trial,
+                "run": run,
+                "config": config,
+            }
+            f.write(json.dumps(event, default=float) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return variant, trials.get(variant)
+
+
+def _read(f) -> dict:
+    trials = {}
+    for line in f:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            # a line cut off by the crash
+            continue
+        trial = trials.setdefault(
+            event["variant"],
+            {"config": None, "trial": None, "run": None, "stages": {}, "reports": []},
+        )
+        if event["event"] == "trial":
+            trial["config"] = event["config"]
+            trial["trial"] = event["trial"]
+            trial["run"] = event.get("run")
+        elif event["event"] == "stage":
+            trial["stages"][event["stage"]] = event
+        elif event["event"] == "report":
+            trial["reports"].append(event["result"])
+    return trials
+
+
+def final_result(trial):
+    """The last result a trial reported after all its stages, or None if it didn't finish."""
+    for result in reversed(trial["reports"]):
+        if "stage" not in result:
+            return result
+    return None
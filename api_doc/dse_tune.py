@@ -0,0 +1,509 @@
+import itertools
+import json
+import math
+import os
+import random
+import uuid
+
+from ray.air import session, RunConfig
+from ray import tune
+from ray.tune.result import AUTO_RESULT_KEYS
+from ray.tune.schedulers import ASHAScheduler, MedianStoppingRule
+from ray.tune.search import ConcurrencyLimiter
+from ray.tune.search.optuna import OptunaSearch
+
+import deadlines
+import dse_journal
+import openroad_api_impl
+import study_store
+import surrogate
+import trial_store
+
+# Flow stages in execution order, and the stage each chateda argument belongs to.
+# Params of tuned() named after a chateda argument are assigned to its stage.
+STAGE_ORDER = ["synth", "floorplan", "place", "cts", "global_route", "detail_route"]
+ARG_STAGE = {
+    "clock_period": "synth",
+    "abc_area": "synth",
+    "core_utilization": "floorplan",
+    "core_aspect_ratio": "floorplan",
+    "core_margins": "floorplan",
+    "macro_place_halo": "floorplan",
+    "macro_place_channel": "floorplan",
+    "density": "place",
+    "tns_end_percent": "cts",
+}
+
+
+# Configs each upstream config of a prefix tree forks into at the next stage
+PREFIX_FANOUT = 2
+
+
+def _param_stage(name, para):
+    return para.get("stage", ARG_STAGE.get(name))
+
+
+def _quniform_values(para):
+    low, high = para["minmax"]
+    step = para["step"]
+    values = [low + i * step for i in range(int(round((high - low) / step)) + 1)]
+    if all(isinstance(v, int) for v in (low, high, step)):
+        return values
+    return [round(v, 10) for v in values]
+
+
+def _trial_tree(param, num_samples, seed=None):
+    """Sample configs as a tree over the stages of the params.
+    Every level of the tree samples the params of one stage, so configs are
+    emitted depth first and siblings share all upstream stage values. Running
+    them in order lets the stage cache compute every shared prefix once.
+    """
+
+    rng = random.Random(seed)
+    levels = [
+        [name for name, para in param.items() if _param_stage(name, para) == stage]
+        for stage in STAGE_ORDER
+    ]
+    # params without a known stage vary per trial, below every stage
+    levels.append(
+        [
+            name
+            for name, para in param.items()
+            if _param_stage(name, para) not in STAGE_ORDER
+        ]
+    )
+    levels = [names for names in levels if names]
+    grids = [
+        list(itertools.product(*[_quniform_values(param[n]) for n in names]))
+        for names in levels
+    ]
+
+    # every config of a stage forks PREFIX_FANOUT configs of the next one, so
+    # each upstream run is shared, and the rest of the budget goes to distinct
+    # configs of the first stage, so its space is actually explored
+    branching = [1] + [min(PREFIX_FANOUT, len(grid)) for grid in grids[1:]]
+    for i in reversed(range(1, len(levels))):
+        if math.prod(branching) <= num_samples:
+            break
+        # more levels than the budget forks: the deepest ones don't
+        branching[i] = 1
+    branching[0] = min(len(grids[0]), max(1, num_samples // math.prod(branching)))
+    # a small first-stage grid leaves budget for wider downstream levels
+    for i in range(1, len(levels)):
+        while (
+            branching[i] < len(grids[i])
+            and math.prod(branching) // branching[i] * (branching[i] + 1) <= num_samples
+        ):
+            branching[i] += 1
+
+    def expand(level, prefix):
+        if level == len(levels):
+            yield prefix
+            return
+        for values in rng.sample(grids[level], branching[level]):
+            values = dict(zip(levels[level], values))
+            yield from expand(level + 1, {**prefix, **values})
+
+    return list(expand(0, {}))
+
+
+def _random_points(param, num_samples, seed=None):
+    """Up to num_samples distinct configs drawn uniformly from the param grid."""
+    rng = random.Random(seed)
+    grids = {name: _quniform_values(para) for name, para in param.items()}
+    points = {}
+    for _ in range(num_samples * 4):
+        point = {name: rng.choice(values) for name, values in grids.items()}
+        points.setdefault(tuple(point.values()), point)
+        if len(points) == num_samples:
+            break
+    return list(points.values())
+
+
+def _screened(param, candidates, history, num_samples):
+    """The num_samples candidates a surrogate fit on the history predicts best,
+    or None if the history has too few finished trials over these params.
+    """
+
+    names = list(param)
+    X, Y = surrogate.load_history(history, names, ["area", "power"])
+    if len(X) < surrogate.MIN_OBSERVATIONS:
+        print(f"surrogate: {len(X)} past trials, screening skipped")
+        return None
+    bounds = [param[n]["minmax"] for n in names]
+    best = surrogate.screen(candidates, names, bounds, X, Y, num_samples)
+    print(
+        f"surrogate: {len(best)} of {len(candidates)} configs kept "
+        f"({len(X)} past trials)"
+    )
+    return best
+
+
+def _journaled_report(journal, variant):
+    """session.report that also appends every result to the sweep journal."""
+
+    def report(metrics, *args, **kwargs):
+        journal.append({"event": "report", "variant": variant, "result": metrics})
+        return _session_report(metrics, *args, **kwargs)
+
+    return report
+
+
+# Result of a trial stopped at a stage limit, the worst of every objective
+LIMIT_PENALTY = openroad_api_impl.WORST_METRICS
+# Ray's own keys of a trial result, left out of the result archived with it
+RAY_RESULT_KEYS = AUTO_RESULT_KEYS + ("done", "trial_id", "experiment_tag")
+# Trial functions call session.report; journaled trials swap in _journaled_report
+_session_report = session.report
+
+
+class _TrialArchiver(tune.Callback):
+    """Moves the flows of every trial that ended (finished, stopped by the
+    scheduler or failed) into the artifact store, once its worker has let go
+    of them. Trials of an interrupted sweep don't end, so a resumed sweep
+    finds their directories in place.
+    """
+
+    def __init__(self, store) -> None:
+        self.store = store
+        self._ended = []
+
+    def on_trial_complete(self, iteration, trials, trial, **info):
+        self._ended.append(trial)
+
+    def on_trial_error(self, iteration, trials, trial, **info):
+        self._ended.append(trial)
+
+    def on_step_begin(self, iteration, trials, **info):
+        # a stopped trial's worker is still winding down when it completes
+        for trial in [t for t in self._ended if t.temporary_state.ray_actor is None]:
+            self._ended.remove(trial)
+            self._archive(trial)
+
+    def on_experiment_end(self, trials, **info):
+        for trial in self._ended:
+            self._archive(trial)
+        self._ended.clear()
+
+    def _archive(self, trial) -> None:
+        result = trial.last_result
+        if not result or "stage" in result:
+            # stopped early: no final result
+            result = None
+        else:
+            result = {k: v for k, v in result.items() if k not in RAY_RESULT_KEYS}
+        self.store.archive_registered(trial.trial_id, result)
+
+
+class _FinalResultSearch(OptunaSearch):
+    """OptunaSearch that only tells Optuna final results. A trial the scheduler
+    stopped early last reported the PPA of an intermediate stage; it is recorded
+    as pruned instead of as a finished trial with, say, placement-stage area.
+    """
+
+    def on_trial_complete(self, trial_id, result=None, error=False):
+        if result and "stage" in result:
+            result = None
+        elif result and "limit" not in result:
+            if trial_id not in self._completed_trials:
+                ot_trial = self._ot_trials[trial_id]
+                ot_trial.set_user_attr(study_store.FINAL_ATTR, True)
+        return super().on_trial_complete(trial_id, result, error)
+
+
+def _run_limited(func, config):
+    """Run a trial function. A trial whose tool run was killed at a stage limit
+    reports LIMIT_PENALTY, so the search steers away from its config.
+    """
+
+    try:
+        return func(config)
+    except deadlines.StageLimitExceeded as e:
+        print(f"trial stopped: {e}")
+        session.report({**LIMIT_PENALTY, "limit": f"{e.stage}:{e.reason}"})
+
+
+def _isolated_trial(
+    func,
+    cpus_per_trial,
+    cache_dir=None,
+    admission_dir=None,
+    journal=None,
+    run=None,
+    store=None,
+    stage_limits=None,
+    deadline_dir=None,
+):
+    """Wrap a trial function so that every trial works in its own FLOW_VARIANT.
+    Ray runs each trial in its own worker process, so the variables set here are
+    picked up by every chateda created inside the trial.
+    """
+
+    def trial(config):
+        variant = "trial_" + session.get_trial_id()
+        if journal is not None:
+            variant, done = dse_journal.Journal(journal).claim(
+                variant, config, session.get_trial_id(), run
+            )
+        os.environ["FLOW_VARIANT"] = variant
+        os.environ["NUM_CORES"] = str(cpus_per_trial)
+        os.environ["CHATEDA_TRIAL_ID"] = session.get_trial_id()
+        os.environ["CHATEDA_REPORT_STAGES"] = "1"
+        if cache_dir is not None:
+            os.environ["CHATEDA_CACHE_DIR"] = cache_dir
+        if admission_dir is not None:
+            os.environ["CHATEDA_ADMISSION_DIR"] = admission_dir
+        if stage_limits is not None:
+            os.environ["CHATEDA_STAGE_LIMITS"] = json.dumps(stage_limits)
+        if deadline_dir is not None:
+            os.environ["CHATEDA_DEADLINE_DIR"] = deadline_dir
+        if store is not None:
+            os.environ["CHATEDA_ARTIFACT_STORE"] = store
+        session.report = _session_report
+        if journal is not None:
+            os.environ["CHATEDA_JOURNAL"] = journal
+            result = done and dse_journal.final_result(done)
+            if result is not None:
+                # finished before the sweep was interrupted
+                _session_report(result)
+                return
+            session.report = _journaled_report(dse_journal.Journal(journal), variant)
+        return _run_limited(func, config)
+
+    return trial
+
+
+def tuned(
+    func,
+    param,
+    num_samples: int = 20,
+    max_concurrent: int = 1,
+    cpus_per_trial: int = 1,
+    time_total_s: int = 600,
+    cache_dir: str = None,
+    scheduler: str = None,
+    prune_metric: str = "wns",
+    prune_mode: str = "max",
+    fidelity: str = None,
+    promote_fraction: float = 0.25,
+    admission_dir: str = None,
+    journal: str = None,
+    resume: bool = False,
+    history: list = None,
+    screen_factor: int = 10,
+    study: str = None,
+    study_dir: str = None,
+    seed_best: int = 3,
+    artifact_store: str = None,
+    artifact_max_bytes: int = trial_store.DEFAULT_MAX_BYTES,
+    stage_limits: dict = None,
+    deadline_dir: str = None,
+    prefix_tree: bool = False,
+):
+    """parameter tuning.
+    Keyword parameters:
+        func -- A function that runs the target flow and return a metric for parameter tuning.
+        The function should take to-be-tuned parameters as its function parameters.
+        The function should return the concerned results as its return value.
+        param -- The flow parameters to be tuned.
+        Param should be a dictionary with the following format:
+        { param_name: {"minmax": [min, max], "step": step} }
+        # The data type of min, max and step is required to be int or float
+        num_samples(int) -- The number of sampled configurations.
+        max_concurrent(int) -- The number of trials run at the same time. Every trial
+        gets its own FLOW_VARIANT, so LOG_DIR/RESULTS_DIR/OBJECTS_DIR don't collide.
+        cpus_per_trial(int) -- CPUs reserved for each trial, also used as its NUM_CORES.
+        time_total_s(int) -- Wall time limit of a single trial in seconds.
+        cache_dir(str) -- Stage result cache shared by all trials.
+        scheduler(str) -- Early stopping of losing trials: "asha", "median" or None.
+        Trials report area/power/wns after floorplan, placement, CTS and global route,
+        and the scheduler compares prune_metric (optimized as prune_mode) at each stage.
+        Stopped trials are recorded as pruned, not with their intermediate results.
+        fidelity(str) -- Multi-fidelity mode: screen all configs on the prune_metric of
+        this stage ("place", "cts", ...) and promote only the best promote_fraction of
+        them to the full detail_route + final_report evaluation.
+        admission_dir(str) -- Share a node-wide admission scheduler between the trials:
+        every tool run waits until the CPU and memory it needs (learned from earlier
+        runs) are free and gets a matching NUM_CORES instead of cpus_per_trial.
+        journal(str) -- Sweep directory for a crash-safe journal of the trials (config,
+        finished stages with their stage keys and artifacts, reported results) and the
+        Ray Tune experiment state.
+        resume(bool) -- Continue the interrupted sweep in journal. Finished trials are not
+        rerun, and unfinished ones pick up after their last finished stage.
+        history(list(str)) -- Sweep directories (journal=...) of earlier runs on the
+        same design and platform. A Gaussian process fit on their (params -> area, power)
+        results ranks num_samples * screen_factor candidate configs, and only the
+        num_samples predicted best are run. Skipped while the history is too short.
+        study(str) -- Label of the tuned design and platform, e.g. "jpeg/nangate45".
+        The Optuna study (search state and trial results) is kept in study_dir
+        (default $CHATEDA_STUDY_DIR or ./.chateda_studies) under this label and the
+        param space, and later sweeps of the same study continue from it. The
+        seed_best best earlier configs are run again first, e.g. after an RTL change.
+        artifact_store(str) -- Move the LOG/OBJECTS/REPORTS/RESULTS_DIR of every
+        trial that ended (finished, stopped early or failed) into a compressed store
+        here, where files shared between trials are kept once. Beyond
+        artifact_max_bytes, trials off the area/power Pareto front are evicted,
+        stopped ones and then the oldest first, down to their metric JSONs.
+        stage_limits(dict) -- Wall time and memory limits per stage of every trial, e.g.
+        {"detail_route": {"wall_s": 7200, "mem_kb": 64 * 2**20}} ("*" for all stages).
+        deadline_dir(str) -- Learn adaptive deadlines of the stages without a fixed
+        wall_s from the earlier runs of all trials. wall_s budgets tool run time only,
+        not waits for the stage cache or admission. A trial with a tool run killed at
+        a limit stops there and reports the worst area/power/wns, tagged with "limit".
+        prefix_tree(bool) -- Sample the configs as a prefix-sharing tree instead of
+        letting Optuna propose them: trials that agree on the upstream stages run them
+        once and fork the downstream stages from the cached odb. Every config of a
+        stage forks PREFIX_FANOUT configs of the next, and the rest of num_samples
+        goes to distinct configs of the first stage. A param may name the flow stage
+        it belongs to with "stage" (one of STAGE_ORDER); params named after a chateda
+        argument (e.g. "density") get its stage by default.
+    """
+
+    param_space = {}
+    for name, para in param.items():
+        param_space[name] = tune.quniform(
+            para["minmax"][0], para["minmax"][1], para["step"]
+        )
+    points = None
+    if prefix_tree:
+        if cache_dir is None:
+            cache_dir = os.path.abspath(".chateda_cache")
+        points = _trial_tree(param, num_samples)
+        if history:
+            candidates = _trial_tree(param, num_samples * screen_factor)
+            best = _screened(param, candidates, history, num_samples)
+            if best is not None:
+                # depth-first order keeps the shared prefixes of the kept leaves
+                points = [p for p in candidates if p in best]
+    elif history:
+        candidates = _random_points(param, num_samples * screen_factor)
+        points = _screened(param, candidates, history, num_samples)
+    search_args, seeds = {}, []
+    if study is not None:
+        if study_dir is None:
+            study_dir = os.environ.get(
+                "CHATEDA_STUDY_DIR", os.path.abspath(".chateda_studies")
+            )
+        search_args["storage"] = study_store.storage(study_dir)
+        search_args["study_name"] = study_store.study_name(study, param)
+        seeds = study_store.best_points(
+            search_args["storage"], search_args["study_name"], seed_best
+        )
+        if seeds:
+            name = search_args["study_name"]
+            print(f"study {name}: seeded {len(seeds)} earlier configs")
+    if points is not None:
+        points = seeds + [p for p in points if p not in seeds]
+        num_samples = len(points)
+    elif seeds:
+        points = seeds
+    searcher = _FinalResultSearch(
+        metric=["area", "power"],
+        mode=["min", "min"],
+        points_to_evaluate=points,
+        **search_args,
+    )
+    algo = ConcurrencyLimiter(searcher, max_concurrent=max_concurrent)
+    if fidelity is not None:
+        # a single successive-halving rung at the fidelity stage
+        scheduler = ASHAScheduler(
+            time_attr="stage_index",
+            metric=prune_metric,
+            mode=prune_mode,
+            max_t=len(openroad_api_impl.REPORTED_STAGES) + 1,
+            grace_period=openroad_api_impl.REPORTED_STAGES.index(fidelity) + 1,
+            reduction_factor=max(2, round(1 / promote_fraction)),
+            brackets=1,
+        )
+    elif scheduler == "asha":
+        scheduler = ASHAScheduler(
+            time_attr="stage_index",
+            metric=prune_metric,
+            mode=prune_mode,
+            # the last rung is before max_t, so trials past global route finish
+            max_t=len(openroad_api_impl.REPORTED_STAGES) + 1,
+            grace_period=openroad_api_impl.REPORTED_STAGES.index("place") + 1,
+            reduction_factor=2,
+        )
+    elif scheduler == "median":
+        scheduler = MedianStoppingRule(
+            time_attr="stage_index",
+            metric=prune_metric,
+            mode=prune_mode,
+            grace_period=openroad_api_impl.REPORTED_STAGES.index("place") + 1,
+            min_samples_required=3,
+        )
+
+    if journal is not None:
+        journal = os.path.abspath(journal)
+    trainable = tune.with_resources(
+        _isolated_trial(
+            func,
+            cpus_per_trial,
+            cache_dir and os.path.abspath(cache_dir),
+            admission_dir and os.path.abspath(admission_dir),
+            journal and os.path.join(journal, dse_journal.JOURNAL_FILE),
+            uuid.uuid4().hex,
+            artifact_store and os.path.abspath(artifact_store),
+            stage_limits,
+            deadline_dir and os.path.abspath(deadline_dir),
+        ),
+        resources={"cpu": cpus_per_trial, "gpu": 0},
+    )
+    callbacks = []
+    if artifact_store is not None:
+        store = trial_store.TrialStore(
+            os.path.abspath(artifact_store), artifact_max_bytes
+        )
+        callbacks.append(_TrialArchiver(store))
+    experiment = journal and os.path.join(journal, "tune")
+    if resume and experiment and tune.Tuner.can_restore(experiment):
+        # trials keep their ids, hence their FLOW_VARIANT and journal entries
+        tuner = tune.Tuner.restore(experiment, trainable, resume_unfinished=True)
+    else:
+        tuner = tune.Tuner(
+            trainable,
+            tune_config=tune.TuneConfig(
+                search_alg=algo,
+                scheduler=scheduler,
+                max_concurrent_trials=max_concurrent,
+                num_samples=num_samples,
+            ),
+            run_config=RunConfig(
+                name=journal and "tune",
+                storage_path=journal,
+                stop={"time_total_s": time_total_s},
+                callbacks=callbacks,
+            ),
+            param_space=param_space,
+        )
+    results = tuner.fit()
+    print(
+        "Best hyperparameters found for area were: ",
+        _best_config(results, "area"),
+    )
+    print(
+        "Best hyperparameters found for power were: ",
+        _best_config(results, "power"),
+    )
+    print("tune done")
+
+
+def _best_config(results, metric):
+    """Config with the smallest final metric, or None if no trial finished.
+    Trials stopped early last reported an intermediate stage result, and trials
+    that hit a stage limit reported LIMIT_PENALTY; both are left out.
+    """
+
+    final = [
+        r
+        for r in results
+        if r.metrics
+        and metric in r.metrics
+        and "stage" not in r.metrics
+        and "limit" not in r.metrics
+    ]
+    if not final:
+        print(f"no trial finished the flow, no best config for {metric}")
+        return None
+    return min(final, key=lambda r: r.metrics[metric]).config
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""Simulated yosys/openroad for measuring chateda without an EDA install.
+
+    fake_eda.py yosys [-v 3] -c synth.tcl
+    fake_eda.py openroad [-exit] [-no_init] script.tcl -metrics out.json
+    fake_eda.py openroad -no_init        (interactive, as used by OrdSession)
+
+A step writes the RESULTS_DIR files the next step reads, a log and, for
+openroad, a metric JSON whose PPA is a smooth function of the flow knobs
+(CORE_UTILIZATION, PLACE_DENSITY, ...) so searches have something to find.
+Its cost is set through the environment:
+    FAKE_EDA_LATENCY    -- seconds every step takes (default 0.05)
+    FAKE_EDA_LOG_LINES  -- log lines every step prints (default 200)
+    FAKE_EDA_LINE_BYTES -- length of a log line (default 80)
+    FAKE_EDA_TIME       -- "1" to end with a /usr/bin/time style line
+    FAKE_EDA_LOAD_LATENCY -- seconds reading the libraries takes, and again
+                             reading the design (default 0); an interactive
+                             session pays them only when it has to
+make_flow() creates a flow tree (design, platform, scripts, util) to set up
+against and install() points a chateda at this backend.
+"""
+
+import hashlib
+import json
+import os
+import re
+import resource
+import sys
+import time
+
+import ord_session
+import stage_cache
+import synth_partition
+
+# RESULTS_DIR files written by every script, in ORFS naming
+OUTPUTS = {
+    "synth.tcl": ["1_1_yosys.v"],
+    "synth_hier_report.tcl": [],
+    "floorplan.tcl": ["2_1_floorplan.odb", "2_floorplan.sdc"],
+    "io_placement_random.tcl": ["2_2_floorplan_io.odb"],
+    "tdms_place.tcl": ["2_3_floorplan_tdms.odb"],
+    "macro_place.tcl": ["2_4_floorplan_macro.odb"],
+    "tapcell.tcl": ["2_5_floorplan_tapcell.odb"],
+    "pdn.tcl": ["2_6_floorplan_pdn.odb"],
+    "global_place_skip_io.tcl": ["3_1_place_gp_skip_io.odb"],
+    "io_placement.tcl": ["3_2_place_iop.odb"],
+    "global_place.tcl": ["3_3_place_gp.odb"],
+    "resize.tcl": ["3_4_place_resized.odb"],
+    "detail_place.tcl": ["3_5_place_dp.odb"],
+    "cts.tcl": ["4_1_cts.odb", "4_cts.sdc"],
+    "fillcell.tcl": ["4_2_cts_fillcell.odb"],
+    "global_route.tcl": ["5_1_grt.odb", "route.guide"],
+    "detail_route.tcl": ["5_2_route.odb"],
+    "density_fill.tcl": ["6_1_fill.odb"],
+    "final_report.tcl": ["6_final.odb", "6_final.v"],
+}
+# run_all.tcl runs every OpenROAD step of the flow
+OUTPUTS["run_all.tcl"] = [
+    out for script, outs in OUTPUTS.items() if script != "synth.tcl" for out in outs
+]
+# Flow stage of every script, whose inputs and knobs its outputs are made of
+SCRIPT_STAGE = {
+    "synth.tcl": "synth",
+    "floorplan.tcl": "floorplan",
+    "io_placement_random.tcl": "floorplan",
+    "tdms_place.tcl": "floorplan",
+    "macro_place.tcl": "floorplan",
+    "tapcell.tcl": "floorplan",
+    "pdn.tcl": "floorplan",
+    "global_place_skip_io.tcl": "place",
+    "io_placement.tcl": "place",
+    "global_place.tcl": "place",
+    "resize.tcl": "place",
+    "detail_place.tcl": "place",
+    "cts.tcl": "cts",
+    "fillcell.tcl": "cts",
+    "global_route.tcl": "global_route",
+    "detail_route.tcl": "detail_route",
+    "density_fill.tcl": "density_fill",
+    "final_report.tcl": "final_report",
+}
+# RESULTS_DIR odb every openroad script loads; floorplan.tcl links the netlist
+INPUT_ODB = {
+    "io_placement_random.tcl": "2_1_floorplan.odb",
+    "tdms_place.tcl": "2_2_floorplan_io.odb",
+    "macro_place.tcl": "2_3_floorplan_tdms.odb",
+    "tapcell.tcl": "2_4_floorplan_macro.odb",
+    "pdn.tcl": "2_5_floorplan_tapcell.odb",
+    "global_place_skip_io.tcl": "2_floorplan.odb",
+    "io_placement.tcl": "3_1_place_gp_skip_io.odb",
+    "global_place.tcl": "3_2_place_iop.odb",
+    "resize.tcl": "3_3_place_gp.odb",
+    "detail_place.tcl": "3_4_place_resized.odb",
+    "cts.tcl": "3_place.odb",
+    "fillcell.tcl": "4_1_cts.odb",
+    "global_route.tcl": "4_cts.odb",
+    "detail_route.tcl": "5_1_grt.odb",
+    "density_fill.tcl": "5_route.odb",
+    "final_report.tcl": "6_1_fill.odb",
+}
+# Metric name prefix of every metric JSON
+METRIC_PREFIX = {
+    "2_1_floorplan": "floorplan",
+    "3_5_opendp": "detailedplace",
+    "4_1_cts": "cts",
+    "5_1_fastroute": "globalroute",
+    "5_2_TritonRoute": "detailedroute",
+    "6_report": "finish",
+}
+
+_DESIGN_CONFIG = """export DESIGN_NAME = {design}
+export PLATFORM = {platform}
+export VERILOG_FILES = $(DESIGN_HOME)/src/{design}/{design}.v
+export SDC_FILE = $(DESIGN_HOME)/$(PLATFORM)/{design}/constraint.sdc
+export CORE_UTILIZATION ?= 40
+export PLACE_DENSITY ?= 0.6
+"""
+_PLATFORM_CONFIG = """export PROCESS = 45
+export LIB_FILES = {libs}
+export DONT_USE_CELLS = TAPCELL_X1 FILLCELL_X1 AOI211_X1 OAI211_X1
+export MIN_ROUTING_LAYER ?= metal2
+export MAX_ROUTING_LAYER ?= metal10
+export PLACE_SITE = FreePDK45_38x28_10R_NP_162NW_34O
+"""
+_CONSTRAINT = """set clk_name core_clock
+set clk_port_name clk
+set clk_period 1000
+create_clock -name $clk_name -period $clk_period [get_ports $clk_port_name]
+"""
+_MARK_DONT_USE = """#!/bin/sh
+# fake markDontUse.py: -p patterns -i in -o out
+while [ $# -gt 0 ]; do
+  case "$1" in -i) in="$2"; shift;; -o) out="$2"; shift;; esac
+  shift
+done
+cp "$in" "$out"
+"""
+
+
+def make_flow(
+    root: str,
+    design: str = "gcd",
+    platform: str = "nangate45",
+    lib_bytes: int = 1 << 20,
+) -> str:
+    """Create a flow tree for design on platform under root and return root."""
+    design_dir = os.path.join(root, "designs", platform, design)
+    platform_dir = os.path.join(root, "platforms", platform)
+    for d in (
+        design_dir,
+        os.path.join(root, "designs", "src", design),
+        os.path.join(platform_dir, "lib"),
+        os.path.join(root, "scripts"),
+        os.path.join(root, "util"),
+    ):
+        os.makedirs(d, exist_ok=True)
+    with open(os.path.join(design_dir, "config.mk"), "w") as f:
+        f.write(_DESIGN_CONFIG.format(design=design, platform=platform))
+    with open(os.path.join(design_dir, "constraint.sdc"), "w") as f:
+        f.write(_CONSTRAINT)
+    with open(os.path.join(root, "designs", "src", design, design + ".v"), "w") as f:
+        f.write(f"module {design}(input clk);\nendmodule\n")
+    lib = os.path.join(platform_dir, "lib", "fake_typ.lib")
+    with open(lib, "w") as f:
+        cell = "cell (FAKE_X1) { area : 1.0; }\n"
+        f.write(cell * max(1, lib_bytes // len(cell)))
+    with open(os.path.join(platform_dir, "config.mk"), "w") as f:
+        f.write(_PLATFORM_CONFIG.format(libs="$(PLATFORM_DIR)/lib/fake_typ.lib"))
+    for script in OUTPUTS:
+        with open(os.path.join(root, "scripts", script), "w") as f:
+            f.write(f"# {script}\n")
+    mark = os.path.join(root, "util", "markDontUse.py")
+    with open(mark, "w") as f:
+        f.write(_MARK_DONT_USE)
+    os.chmod(mark, 0o755)
+    return root
+
+
+def install(ceda, time_line: bool = None) -> None:
+    """Make ceda run this backend instead of yosys and openroad."""
+    backend = f"{sys.executable} {os.path.abspath(__file__)}"
+    ceda.yosys_cmd = backend + " yosys"
+    ceda.ord_cmd = backend + " openroad -exit -no_init"
+    if ceda.ord_session is not None:
+        ceda.ord_session.ord_cmd = backend + " openroad -no_init"
+    if time_line is None:
+        time_line = not os.path.exists("/usr/bin/time")
+    if time_line:
+        # the backend reports its own usage in /usr/bin/time format
+        ceda.time_cmd = ""
+        ceda.env["FAKE_EDA_TIME"] = "1"
+
+
+def _knob(env, name, default):
+    try:
+        return float(env.get(name, default))
+    except ValueError:
+        return default
+
+
+def _noise(env, stem):
+    """Deterministic jitter in [-1, 1) per flow configuration and step."""
+    knobs = "|".join(
+        env.get(k, "")
+        for k in (
+            "DESIGN_NAME",
+            "CORE_UTILIZATION",
+            "CORE_ASPECT_RATIO",
+            "PLACE_DENSITY",
+            "TNS_END_PERCENT",
+            "ABC_CLOCK_PERIOD_IN_PS",
+        )
+    )
+    digest = hashlib.sha256((knobs + stem).encode()).digest()
+    return int.from_bytes(digest[:4], "big") / 2**31 - 1
+
+
+def metrics(env, stem: str) -> dict:
+    """Metric JSON of a step: PPA that depends smoothly on the flow knobs."""
+    prefix = METRIC_PREFIX.get(stem, stem.split("_", 2)[-1])
+    util = _knob(env, "CORE_UTILIZATION", 40) / 100
+    aspect = _knob(env, "CORE_ASPECT_RATIO", 1)
+    density = _knob(env, "PLACE_DENSITY", 0.6)
+    tns_percent = _knob(env, "TNS_END_PERCENT", 20) / 100
+    noise = _noise(env, stem)
+    area = 10000 / max(util, 0.05) * (1 + 0.05 * abs(aspect - 1))
+    # packed designs route worse; fixing more paths costs power
+    wns = -0.2 * max(0, util + density - 1.2) - 0.05 * (1 - tns_percent) + 0.02 * noise
+    power = 0.01 * (1 + 0.3 * density + 0.2 * tns_percent) * (1 + 0.02 * noise)
+    return {
+        prefix + "__timing__setup__ws": wns,
+        prefix + "__timing__setup__tns": min(0, wns) * 50,
+        prefix + "__design__core__area": area,
+        prefix + "__design__instance__count": int(area / 2),
+        prefix + "__power__total": power,
+        prefix + "__performance": 1 / (1 - wns) if wns < 1 else 1.0,
+    }
+
+
+def _log(script, env) -> None:
+    lines = int(env.get("FAKE_EDA_LOG_LINES", "200"))
+    width = int(env.get("FAKE_EDA_LINE_BYTES", "80"))
+    latency = float(env.get("FAKE_EDA_LATENCY", "0.05"))
+    pause = latency / lines if lines else 0
+    for i in range(lines):
+        text = f"[INFO FAKE-{i % 1000:04d}] {os.path.basename(script)} iteration {i} "
+        print(text.ljust(width, "."), flush=pause > 1e-3)
+        if pause > 1e-3:
+            time.sleep(pause)
+    if pause <= 1e-3:
+        time.sleep(latency)
+
+
+class _Stale(Exception):
+    """A session script asked for another design than the one in memory."""
+
+
+def _load(name, results_dir, env, interp) -> None:
+    """Pay for reading the libraries and the design a script loads. interp is
+    the state of an interactive session, None for a fresh process.
+    """
+
+    if name not in SCRIPT_STAGE or name == "synth.tcl":
+        return
+    load_s = float(env.get("FAKE_EDA_LOAD_LATENCY", "0"))
+    if interp is None:
+        time.sleep(2 * load_s)
+        return
+    design = INPUT_ODB.get(name)
+    design = design and os.path.abspath(os.path.join(results_dir, design))
+    if interp["block"] is not None:
+        if design not in interp["same"]:
+            raise _Stale()
+    else:
+        time.sleep(load_s if interp["libs"] else 2 * load_s)
+    interp["libs"] = True
+
+
+def _run_script(script, metrics_path, env, interp=None) -> int:
+    """Pretend to run script: log, write its outputs and metrics."""
+    results_dir = env.get("RESULTS_DIR", ".")
+    name = os.path.basename(script)
+    _load(name, results_dir, env, interp)
+    _log(script, env)
+    os.makedirs(results_dir, exist_ok=True)
+    # like a real tool's, the outputs are a function of the stage's input files
+    # and knobs, so runs of different configs never write the same odb
+    key = ""
+    if name in SCRIPT_STAGE:
+        key = stage_cache.stage_key(
+            SCRIPT_STAGE[name], {**env, "RESULTS_DIR": results_dir}
+        )
+    design = env.get("DESIGN_NAME", "")
+    for out in OUTPUTS.get(name, []):
+        path = os.path.join(results_dir, out)
+        # written in place, as real tools do
+        with open(path, "w") as f:
+            if out == "1_1_yosys.v":
+                f.write(f"// {key}\nmodule {design} ();\nendmodule\n")
+            else:
+                f.write(f"fake {out} of {design} from {key}\n")
+        if interp is not None and out.endswith(".odb"):
+            interp["block"] = os.path.abspath(path)
+    if name == "synth_hier_report.tcl":
+        _mark_stop_modules(env)
+    if metrics_path:
+        stem = os.path.splitext(os.path.basename(metrics_path))[0]
+        with open(metrics_path, "w") as f:
+            json.dump(metrics(env, stem), f, indent=2)
+    return 0
+
+
+def _mark_stop_modules(env) -> None:
+    """Keep every module of the design but its top as hierarchy."""
+    design = synth_partition.Design(env.get("VERILOG_FILES", "").split())
+    with open(env["SYNTH_STOP_MODULE_SCRIPT"], "w") as f:
+        f.write(f"hierarchy -check -top {env['DESIGN_NAME']}\n")
+        for module in design.file_of:
+            if module != env["DESIGN_NAME"]:
+                f.write(f"select -module {{{module}}}\n")
+                f.write("setattr -mod -set keep_hierarchy 1\n")
+                f.write("select -clear\n")
+
+
+def _time_line(start) -> None:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    wall = time.time() - start
+    cpu = usage.ru_utime + usage.ru_stime
+    minutes, seconds = divmod(wall, 60)
+    print(
+        f"Elapsed time: {int(minutes)}:{seconds:05.2f}[h:]min:sec. "
+        f"CPU time: user {usage.ru_utime:.2f} sys {usage.ru_stime:.2f} "
+        f"({int(100 * cpu / wall) if wall else 0}%). "
+        f"Peak memory: {usage.ru_maxrss}KB."
+    )
+
+
+def _tcl_words(text: str) -> list:
+    """Values of the Tcl words quoted by ord_session.tcl_quote() in text."""
+    words = re.findall(r'"((?:\\.|[^"\\])*)"', text)
+    return [re.sub(r"\\(.)", r"\1", w) for w in words]
+
+
+def _session(env) -> int:
+    """Serve the commands OrdSession sends, sourcing scripts as batch runs do."""
+    env = dict(env)
+    interp = {"libs": False, "block": None, "same": []}
+    metrics_path = None
+    rc = stale = 0
+    for line in sys.stdin:
+        line = line.strip()
+        var = re.match(r"(set|unset -nocomplain) ::env\((\w+)\)", line)
+        if var and var.group(1) == "set":
+            env[var.group(2)] = _tcl_words(line)[0]
+        elif var:
+            env.pop(var.group(2), None)
+        elif line.startswith("set ::chateda::same "):
+            interp["same"] = _tcl_words(line)
+        elif line.startswith("utl::open_metrics "):
+            metrics_path = _tcl_words(line)[0]
+        elif line.startswith("set chateda_rc [catch {source "):
+            try:
+                script = _tcl_words(line)[0]
+                rc, stale = _run_script(script, metrics_path, env, interp), 0
+            except _Stale:
+                print("chateda-stale-design", flush=True)
+                rc, stale = 1, 1
+        elif line.startswith(f'puts "{ord_session.DONE_MARK}'):
+            block = interp["block"] or ""
+            print(f"{ord_session.DONE_MARK} {rc} {stale} {block}", flush=True)
+        elif line == "exit":
+            break
+    return 0
+
+
+def main(argv) -> int:
+    start = time.time()
+    tool, args = argv[1], argv[2:]
+    env = os.environ
+    if tool == "yosys":
+        script = args[args.index("-c") + 1]
+        rc = _run_script(script, None, env)
+    else:
+        scripts = [a for a in args if a.endswith(".tcl")]
+        if not scripts:
+            return _session(env)
+        metrics_path = args[args.index("-metrics") + 1] if "-metrics" in args else None
+        rc = _run_script(scripts[0], metrics_path, env)
+    if env.get("FAKE_EDA_TIME") == "1":
+        _time_line(start)
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,25 @@
+import fcntl
+import json
+import os
+
+
+def update(path: str, update_state, empty):
+    """Run update_state(state) on the JSON document in path under an exclusive
+    lock (path + ".lock") and save the state it leaves; return its result.
+    A missing or unreadable document starts as empty(). The document is
+    replaced atomically, so processes sharing it never read a partial one.
+    """
+
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = empty()
+        result = update_state(state)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+        return result
@@ -0,0 +1,94 @@
+import json
+import sqlite3
+import threading
+
+RUN_KEY = ("design", "platform", "variant", "trial", "stage")
+
+
+class MetricsStore:
+    """SQLite index of the `-metrics` JSON of every flow step.
+
+    Metrics are keyed by design/platform/variant/trial/stage, where stage is
+    the metric file name without .json (e.g. "2_1_floorplan"). Many flows and
+    processes can share one store file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS metrics ("
+                "design TEXT, platform TEXT, variant TEXT, trial TEXT, stage TEXT, "
+                "name TEXT, value REAL, "
+                "PRIMARY KEY (design, platform, variant, trial, stage, name))"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS metrics_by_name ON metrics (name, stage)"
+            )
+
+    def ingest(self, json_path: str, **run) -> dict:
+        """Load a metric JSON, index its numeric values under run and return all of it."""
+        with open(json_path) as f:
+            data = json.load(f)
+        key = tuple(str(run.get(k, "")) for k in RUN_KEY)
+        rows = [
+            key + (name, float(value))
+            for name, value in data.items()
+            if isinstance(value, (int, float))
+        ]
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM metrics WHERE design=? AND platform=? AND variant=? "
+                "AND trial=? AND stage=?",
+                key,
+            )
+            self._db.executemany(
+                "INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+        return data
+
+    def query(self, names, **where) -> dict:
+        """Batch query metrics of many runs.
+        Keyword parameters:
+            names(list(str)) -- Metric names, e.g. ["finish__power__total"].
+            where -- Filters on design, platform, variant, trial and stage; a value may be a list.
+        Return:
+            A dict with one NumPy array per run key field and per metric name,
+            aligned by run. Metrics a run doesn't have are NaN.
+        """
+
+        import numpy as np
+
+        sql = "SELECT design, platform, variant, trial, stage, name, value FROM metrics"
+        clauses = ["name IN (%s)" % ",".join("?" * len(names))]
+        args = list(names)
+        for field, value in where.items():
+            if field not in RUN_KEY:
+                raise ValueError(f"unknown run key field: {field}")
+            values = value if isinstance(value, (list, tuple)) else [value]
+            clauses.append(f"{field} IN (%s)" % ",".join("?" * len(values)))
+            args += [str(v) for v in values]
+        sql += " WHERE " + " AND ".join(clauses)
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+
+        runs = {}
+        for row in rows:
+            runs.setdefault(row[:5], {})[row[5]] = row[6]
+        keys = sorted(runs)
+        result = {
+            field: np.array([k[i] for k in keys], dtype=object)
+            for i, field in enumerate(RUN_KEY)
+        }
+        for name in names:
+            result[name] = np.array(
+                [runs[k].get(name, np.nan) for k in keys], dtype=float
+            )
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -1,39 +1,469 @@
+import asyncio
+import contextlib
+import functools
+import hashlib
 import json
 import os
 import shutil
+import signal
 import subprocess
-
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import admission
+import artifacts
+import deadlines
+import dse_journal
+import metrics_store
+import ord_session
 import parse_mk_config
+import sdc_overlay
+import stage_cache
+import step_trace
+import synth_partition
+import trial_store
+
+
+# Metric JSON and metric name prefix of the stages get_metric() reads
+STAGE_METRICS = {
+    "floorplan": ("2_1_floorplan", "floorplan"),
+    "place": ("3_5_opendp", "detailedplace"),
+    "cts": ("4_1_cts", "cts"),
+    "global_route": ("5_1_fastroute", "globalroute"),
+    "route": ("5_2_TritonRoute", "detailedroute"),
+    "final": ("6_report", "finish"),
+}
+# Stages that report intermediate results to Ray Tune, in flow order
+REPORTED_STAGES = ["floorplan", "place", "cts", "global_route"]
+METRIC_SUFFIX = {
+    "tns": "__timing__setup__tns",
+    "wns": "__timing__setup__ws",
+    "area": "__design__core__area",
+    "power": "__power__total",
+    "performance": "__performance",
+}
+# The worst value of every objective reported to Ray Tune
+WORST_METRICS = {"area": 9999999, "power": 9999999, "wns": -9999999}
+
+
+def _stage_steps(steps):
+    """Make a stage method out of a generator of the stage's steps.
+    The generator yields ("restore", stage), ("ord", script, metric, log),
+    ("cmd", cmd, log, script), ("cmds", [(cmd, log, script, env)], workers)
+    and ("store", stage) steps and is sent the result of each; _drive()
+    executes them. The same stage body thus serves the blocking chateda and
+    the asyncio async_chateda.
+    """
 
-import ray
-from ray.air import session, RunConfig
-from ray import tune
-from ray.tune.search import ConcurrencyLimiter
-from ray.tune.search.optuna import OptunaSearch
+    @functools.wraps(steps)
+    def stage(self, *args, **kwargs):
+        return self._drive(steps(self, *args, **kwargs))
+
+    return stage
 
 
 class chateda:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        cache_dir: str = None,
+        cache_max_bytes: int = stage_cache.DEFAULT_MAX_BYTES,
+        stream: bool = False,
+        on_output=None,
+        admission_dir: str = None,
+        sdc_vars: dict = None,
+        stage_limits: dict = None,
+        deadline_dir: str = None,
+        session: bool = False,
+    ) -> None:
         """User Guide: Any steps in follows can't be executed unless the previous step has been executed. The usual flow of chip designing goes like this in sequence: a. Setup; b. Synthesis; c. Floorplanning; d. Placement; e. Clock Tree Synthesis (CTS); f. Global Routing; g. Detailed Routing; h. Density Fill; i. Final Report; 
+        Keyword parameters:
+            cache_dir(str) -- Directory of the stage result cache. Defaults to $CHATEDA_CACHE_DIR; caching is off if neither is set.
+            cache_max_bytes(int) -- Size limit of the stage result cache; least recently used results are evicted first.
+            stream(bool) -- Tee tool output line by line to the log file and console instead of buffering whole logs in memory.
+            on_output -- Called with every streamed output line instead of printing it to the console.
+            admission_dir(str) -- State directory of a node-wide admission scheduler shared by concurrent flows. Defaults to $CHATEDA_ADMISSION_DIR; off if neither is set. Tool runs then wait for the CPU and memory they are expected to need and get a matching NUM_CORES.
+            sdc_vars(dict) -- Tcl variables of the design SDC to override in this flow, e.g. {"clk_io_pct": 0.3}. They are applied, with the clock period of run_synthesis(), to a copy of the SDC in RESULTS_DIR; the design's SDC file is never modified.
+            stage_limits(dict) -- Wall time and memory limits of the stages, e.g. {"detail_route": {"wall_s": 7200, "mem_kb": 64 * 2**20}}; "*" applies to stages not listed. Defaults to the JSON in $CHATEDA_STAGE_LIMITS. wall_s budgets the time the stage's tools run, not waits for the stage cache lock or for admission. A tool run that takes its stage past wall_s or its memory limit is killed with its whole process group and the stage fails with deadlines.TIMEOUT_STATUS or MEMORY_STATUS.
+            deadline_dir(str) -- State directory of the tool run times of earlier runs of each stage, shared by concurrent flows. Defaults to $CHATEDA_DEADLINE_DIR. Stages without a fixed wall_s then get an adaptive deadline of a multiple of their usual tool run time.
+            session(bool) -- Run the OpenROAD scripts of the flow in one persistent interpreter instead of one process per step. LEF/Liberty files are read once, and a step loading the odb the previous step wrote keeps the design in memory. A step asking for another design restarts the interpreter; a step that fails is rerun in a fresh process.
         """
 
-        self.ord = subprocess.Popen(
-            "openroad", stdin=subprocess.PIPE, stdout=subprocess.PIPE
-        )
+        # Each flow owns its own copy of the environment, so several flows can
+        # run side by side in one process without overwriting each other.
+        self.env = dict(os.environ)
+
+        self.ord = None
         self.time_cmd = "/usr/bin/time -f 'Elapsed time: %E[h:]min:sec. CPU time: user %U sys %S (%P). Peak memory: %MKB.'"
         self.yosys_cmd = "yosys"
         self.yosys_flags = "-v 3"
         self.ord_cmd = "openroad -exit -no_init"
+        self.ord_session = (
+            ord_session.OrdSession("openroad -no_init") if session else None
+        )
+
+        if cache_dir is None:
+            cache_dir = self.env.get("CHATEDA_CACHE_DIR")
+        self.cache = (
+            stage_cache.StageCache(cache_dir, cache_max_bytes) if cache_dir else None
+        )
+        if admission_dir is None:
+            admission_dir = self.env.get("CHATEDA_ADMISSION_DIR")
+        self.admission = (
+            admission.AdmissionScheduler(admission_dir) if admission_dir else None
+        )
+        journal = self.env.get("CHATEDA_JOURNAL")
+        self.journal = dse_journal.Journal(journal) if journal else None
+        if stage_limits is None:
+            stage_limits = json.loads(self.env.get("CHATEDA_STAGE_LIMITS", "{}"))
+        self.stage_limits = stage_limits
+        if deadline_dir is None:
+            deadline_dir = self.env.get("CHATEDA_DEADLINE_DIR")
+        self.stage_history = (
+            deadlines.StageHistory(deadline_dir) if deadline_dir else None
+        )
+        self._journaled = None
+        self.stream = stream
+        self.publish_modes = artifacts.DEFAULT_MODES
+        self.on_output = on_output
+        self.metrics_store = None
+        self.sdc_vars = dict(sdc_vars or {})
+        self._sdc_source = None
+        self._metrics = {}
+        # one record per tool run: stage, step, script, wall/CPU time, peak RSS, exit code
+        self.step_records = []
+        self._stage = None
+        self._stage_key = None
+        self._stage_lock = None
+        self._stage_status = 0
+        self._stage_wall_s = None
+        self._stage_mem_kb = None
+        # wall time the running stage's tools have run; parallel runs count once
+        self._stage_busy_s = 0.0
+        self._busy_since = None
+        self._tools_running = 0
+        self._busy_lock = threading.Lock()
+        # the limit a tool run of the running stage was killed at
+        self._limit_hit = None
 
         print("init done")
 
     def help(self) -> None:
+        self.ord = subprocess.Popen(
+            "openroad", stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=self.env
+        )
         outs, _ = self.ord.communicate(b"help")
         self._print(outs)
 
+    def close(self) -> None:
+        """Stop the persistent OpenROAD session, if any."""
+        if self.ord_session is not None:
+            self.ord_session.close()
+
     def _print(self, outs) -> None:
         print("".join(outs.decode().splitlines(keepends=True)[:-1]), flush=True)
 
+    def _output(self, line: str) -> None:
+        if self.on_output is not None:
+            self.on_output(line)
+        else:
+            print(line, end="", flush=True)
+
+    def _run_cmd(self, cmd: str, log_to: str, script: str = None, env=None) -> int:
+        """Run a tool command, write its output to the log file log_to and return its exit status.
+        The command runs in env, the flow environment by default.
+        """
+
+        env = self.env if env is None else env
+        with self._admitted(log_to, env):
+            start = time.time()
+            timing = None
+            proc = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                shell=True,
+                env=env,
+                # the shell, time and the tool form one group that is killed together
+                start_new_session=True,
+            )
+            try:
+                with open(log_to, "w") as log_file, self._watchdog(proc) as watchdog:
+                    if not self.stream:
+                        outs, _ = proc.communicate()
+                        self._print(outs)
+                        outs = outs.decode()
+                        log_file.write(outs)
+                        timing = step_trace.parse_time_line(outs)
+                    else:
+                        with proc.stdout:
+                            for line in proc.stdout:
+                                line = line.decode(errors="replace")
+                                log_file.write(line)
+                                self._output(line)
+                                if line.startswith("Elapsed time:"):
+                                    timing = step_trace.parse_time_line(line)
+                    status = proc.wait()
+            except BaseException:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                proc.wait()
+                raise
+            status = self._limited(watchdog, status, log_to)
+            self._record_step(log_to, script, start, status, timing)
+            return status
+
+    @contextlib.contextmanager
+    def _watchdog(self, proc):
+        """Watchdog of the stage's limits for a tool run leading its process group.
+        Only the time the stage's tools run counts against its wall_s, not waits
+        for the stage lock or for admission.
+        """
+
+        with self._busy_lock:
+            now = time.time()
+            if self._tools_running == 0:
+                self._busy_since = now
+            self._tools_running += 1
+            busy_s = self._stage_busy_s + now - self._busy_since
+        deadline = None
+        if self._stage_wall_s is not None:
+            deadline = now + self._stage_wall_s - busy_s
+        try:
+            with deadlines.Watchdog(proc.pid, deadline, self._stage_mem_kb) as watchdog:
+                yield watchdog
+        finally:
+            with self._busy_lock:
+                self._tools_running -= 1
+                if self._tools_running == 0:
+                    self._stage_busy_s += time.time() - self._busy_since
+
+    def _limited(self, watchdog, status: int, log_to: str) -> int:
+        """Exit status of a tool run, or the limit status if its watchdog killed it."""
+        if watchdog.reason is None:
+            return status
+        step = os.path.splitext(os.path.basename(log_to))[0]
+        print(f"{step} killed over the {watchdog.reason} limit of {self._stage}")
+        self._limit_hit = {
+            "stage": self._stage,
+            "step": step,
+            "reason": watchdog.reason,
+        }
+        return deadlines.LIMIT_STATUSES[watchdog.reason]
+
+    def _start_limits(self) -> None:
+        """Start the wall time and memory budget of the stage self._stage."""
+        limits = self.stage_limits.get(self._stage, self.stage_limits.get("*", {}))
+        wall_s = limits.get("wall_s")
+        if wall_s is None and self.stage_history is not None:
+            wall_s = self.stage_history.deadline_s(self._history_key())
+        self._stage_wall_s = wall_s
+        self._stage_mem_kb = limits.get("mem_kb")
+        self._stage_busy_s = 0.0
+        self._limit_hit = None
+
+    def _history_key(self) -> str:
+        return "/".join(
+            [self.env.get("DESIGN_NAME", ""), self.env.get("PLATFORM", ""), self._stage]
+        )
+
+    def _stop_at_limit(self, steps) -> int:
+        """End the stage after one of its tool runs was killed at a limit, and
+        return the limit status. In a tuned() trial the whole trial ends.
+        """
+
+        steps.close()
+        self._release_stage_lock()
+        limit_hit, self._limit_hit = self._limit_hit, None
+        self._stage_status = deadlines.LIMIT_STATUSES[limit_hit["reason"]]
+        if self.env.get("CHATEDA_TRIAL_ID"):
+            raise deadlines.StageLimitExceeded(**limit_hit)
+        return self._stage_status
+
+    @contextlib.contextmanager
+    def _admitted(self, log_to: str, env=None):
+        """Hold an admission grant for the step logging to log_to, with NUM_CORES set to it."""
+        if self.admission is None:
+            yield
+            return
+        grant = self.admission.acquire(os.path.splitext(os.path.basename(log_to))[0])
+        with self._granted(grant, env):
+            yield
+
+    @contextlib.contextmanager
+    def _granted(self, grant, env=None):
+        env = self.env if env is None else env
+        num_cores = env.get("NUM_CORES")
+        env["NUM_CORES"] = str(grant["cores"])
+        records = len(self.step_records)
+        try:
+            yield
+        finally:
+            if num_cores is None:
+                del env["NUM_CORES"]
+            else:
+                env["NUM_CORES"] = num_cores
+            # the step's timing teaches the scheduler its profile; parallel
+            # steps append their records too, so look it up by step
+            record = next(
+                (r for r in self.step_records[records:] if r["step"] == grant["step"]),
+                None,
+            )
+            self.admission.release(grant, record)
+
+    def _drive(self, steps):
+        """Execute the steps of a stage one after another and return its result."""
+        result = None
+        try:
+            while True:
+                try:
+                    step = steps.send(result)
+                except StopIteration as stop:
+                    # stages that fail early return before their "store" step
+                    self._release_stage_lock()
+                    return stop.value
+                result = self._run_step(*step)
+                if self._limit_hit is not None:
+                    return self._stop_at_limit(steps)
+        except BaseException:
+            steps.close()
+            self._release_stage_lock()
+            raise
+
+    def _run_step(self, kind: str, *args):
+        run = {
+            "restore": self._restore_stage,
+            "store": self._store_stage,
+            "ord": self._run_ord_cmd,
+            "cmd": self._run_cmd,
+            "cmds": self._run_cmds,
+        }[kind]
+        return run(*args)
+
+    def _run_cmds(self, jobs, workers: int) -> list:
+        """Run (cmd, log_to, script, env) jobs, workers at a time; return their exit statuses."""
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return list(pool.map(lambda job: self._run_cmd(*job), jobs))
+
+    def _record_step(self, log_to, script, start, exit_code, timing) -> None:
+        record = {
+            "flow": "/".join(
+                self.env.get(k, "") for k in ("DESIGN_NAME", "PLATFORM", "FLOW_VARIANT")
+            ),
+            "stage": self._stage,
+            "step": os.path.splitext(os.path.basename(log_to))[0],
+            "script": script,
+            "start": start,
+            "wall_s": time.time() - start,
+            "user_s": None,
+            "sys_s": None,
+            "cpu_percent": None,
+            "peak_rss_kb": None,
+            "exit_code": exit_code,
+        }
+        if timing is not None:
+            record.update(timing)
+        self.step_records.append(record)
+
+    def export_step_records(self, path: str) -> None:
+        """Write the per-step timing and peak memory records as JSON."""
+        step_trace.write_json(self.step_records, path)
+
+    def export_trace(self, path: str) -> None:
+        """Write the tool runs as a Chrome trace / Perfetto timeline."""
+        step_trace.write_chrome_trace(self.step_records, path)
+
+    def _publish(self, src: str, dst: str) -> None:
+        """Hand an artifact to the next step as a reflink/hardlink, copying only if needed."""
+        artifacts.publish(src, dst, self.publish_modes)
+        if self.ord_session is not None:
+            self.ord_session.alias(src, dst)
+
+    def _restore_stage(self, stage: str) -> bool:
+        """Start a stage; restore its outputs from the cache if its inputs and knobs were seen before."""
+        self._stage = stage
+        self._stage_status = 0
+        self._release_stage_lock()
+        self._start_limits()
+        if self.cache is not None or self.journal is not None:
+            self._stage_key = stage_cache.stage_key(stage, self.env)
+        if self._resume_stage(stage):
+            print(f"{stage} resumed from the journal")
+            return True
+        if self.cache is not None:
+            if self.cache.restore(self._stage_key, self.env):
+                print(f"{stage} restored from cache")
+                return True
+            # Flows forked from the same prefix may be running this very stage;
+            # wait for them and reuse their result instead of running it twice.
+            self._stage_lock = self.cache.lock(self._stage_key)
+            if self.cache.restore(self._stage_key, self.env):
+                self._release_stage_lock()
+                print(f"{stage} restored from cache")
+                return True
+        self._unlink_outputs([stage])
+        return False
+
+    def _unlink_outputs(self, stages) -> None:
+        """Drop the outputs of stages before their tools write new ones. They may
+        be hard links to cached or published files, which tools writing in
+        place would corrupt.
+        """
+
+        artifacts.unlink_outputs(
+            os.path.join(self.env[d], name)
+            for stage in stages
+            for d, name in stage_cache.stage_outputs(stage, self.env)
+        )
+
+    def _store_stage(self, stage: str) -> None:
+        """Finish a stage; cache its outputs if every step succeeded."""
+        if self._stage_status == 0:
+            if self.stage_history is not None:
+                self.stage_history.record(self._history_key(), self._stage_busy_s)
+            if self.cache is not None:
+                self.cache.store(self._stage_key, stage, self.env)
+            if self.journal is not None:
+                self.journal.append(
+                    {
+                        "event": "stage",
+                        "variant": self.env["FLOW_VARIANT"],
+                        "stage": stage,
+                        "key": self._stage_key,
+                        "dirs": {d: self.env[d] for d in stage_cache.OUTPUT_DIRS},
+                        "files": list(stage_cache.stage_outputs(stage, self.env)),
+                    }
+                )
+        self._release_stage_lock()
+
+    def _resume_stage(self, stage: str) -> bool:
+        """Whether an interrupted run of this trial already finished stage with
+        the same inputs and knobs, and left its outputs in place.
+        """
+
+        if self.journal is None:
+            return False
+        if self._journaled is None:
+            trial = self.journal.trials().get(self.env["FLOW_VARIANT"])
+            self._journaled = trial["stages"] if trial else {}
+        done = self._journaled.get(stage)
+        return (
+            done is not None
+            and done["key"] == self._stage_key
+            and all(done["dirs"][d] == self.env[d] for d in done["dirs"])
+            and all(
+                os.path.exists(os.path.join(self.env[d], n)) for d, n in done["files"]
+            )
+        )
+
+    def _release_stage_lock(self) -> None:
+        if self._stage_lock is not None:
+            self.cache.unlock(self._stage_lock)
+            self._stage_lock = None
+
     # Setup
     def setup(
         self,
@@ -52,10 +482,10 @@ class chateda:
             sdc(str) --  The path to design constraint (SDC) file.
         """
 
-        os.environ["DESIGN_NAME"] = (
+        self.env["DESIGN_NAME"] = (
             "aes_cipher_top" if design_name == "aes" else design_name
         )
-        os.environ["PLATFORM"] = platform
+        self.env["PLATFORM"] = platform
         if verilog is None:
             verilog = os.path.join(
                 flow_home, "designs/src/", design_name, design_name + ".v"
@@ -64,37 +494,41 @@ class chateda:
             sdc = os.path.join(
                 flow_home, "./designs/", platform, design_name, "constraint.sdc"
             )
-        os.environ["VERILOG_FILES"] = verilog
-        os.environ["SDC_FILE"] = sdc
+        self.env["VERILOG_FILES"] = verilog
+        self.env["SDC_FILE"] = sdc
+        self._sdc_source = sdc
 
-        os.environ["FLOW_HOME"] = flow_home
-        os.environ["DESIGN_HOME"] = os.path.join(flow_home, "designs")
-        os.environ["PLATFORM_HOME"] = os.path.join(flow_home, "platforms")
-        os.environ["WORK_HOME"] = flow_home
+        self.env["FLOW_HOME"] = flow_home
+        self.env["DESIGN_HOME"] = os.path.join(flow_home, "designs")
+        self.env["PLATFORM_HOME"] = os.path.join(flow_home, "platforms")
+        self.env["WORK_HOME"] = flow_home
 
-        os.environ["UTILS_DIR"] = os.path.join(flow_home, "util")
-        os.environ["SCRIPTS_DIR"] = os.path.join(flow_home, "scripts")
-        os.environ["TEST_DIR"] = os.path.join(flow_home, "test")
-        os.environ["PLATFORM_DIR"] = os.path.join(os.environ["PLATFORM_HOME"], platform)
+        self.env["UTILS_DIR"] = os.path.join(flow_home, "util")
+        self.env["SCRIPTS_DIR"] = os.path.join(flow_home, "scripts")
+        self.env["TEST_DIR"] = os.path.join(flow_home, "test")
+        self.env["PLATFORM_DIR"] = os.path.join(self.env["PLATFORM_HOME"], platform)
 
         # parse design config first, because parse_mk_config ignores
         # those already defined env vars
         design_config = parse_mk_config.parse(
-            os.path.join(os.environ["DESIGN_HOME"], platform, design_name, "config.mk")
+            os.path.join(self.env["DESIGN_HOME"], platform, design_name, "config.mk"),
+            env=self.env,
         )
         for k, v in design_config.items():
-            os.environ[k] = v
+            self.env[k] = v
 
         platform_config = parse_mk_config.parse(
-            os.path.join(os.environ["PLATFORM_DIR"], "config.mk")
+            os.path.join(self.env["PLATFORM_DIR"], "config.mk"), env=self.env
         )
         for k, v in platform_config.items():
-            os.environ[k] = v
+            self.env[k] = v
 
         default_env_vars = {
             "GALLERY_REPORT": "0",
             # Enables hierarchical yosys
             "SYNTH_HIERARCHICAL": "0",
+            # Synthesizes the hierarchy's stop modules in parallel yosys runs
+            "SYNTH_PARALLEL": "0",
             "RESYNTH_AREA_RECOVER": "0",
             "RESYNTH_TIMING_RECOVER": "0",
             "ABC_AREA": "0",
@@ -110,49 +544,60 @@ class chateda:
             "DESIGN_NICKNAME": "$(DESIGN_NAME)",
         }
         for k, v in default_env_vars.items():
-            if k not in os.environ:
-                os.environ[k] = v
+            if k not in self.env:
+                self.env[k] = v
 
-        os.environ["DESIGN_DIR"] = os.path.join(
+        self.env["DESIGN_DIR"] = os.path.join(
             flow_home, "designs", platform, design_name
         )
-        os.environ["LOG_DIR"] = os.path.join(
-            flow_home, "logs", platform, design_name, os.environ["FLOW_VARIANT"]
+        self.env["LOG_DIR"] = os.path.join(
+            flow_home, "logs", platform, design_name, self.env["FLOW_VARIANT"]
         )
-        os.environ["OBJECTS_DIR"] = os.path.join(
-            flow_home, "objects", platform, design_name, os.environ["FLOW_VARIANT"]
+        self.env["OBJECTS_DIR"] = os.path.join(
+            flow_home, "objects", platform, design_name, self.env["FLOW_VARIANT"]
         )
-        os.environ["REPORTS_DIR"] = os.path.join(
-            flow_home, "reports", platform, design_name, os.environ["FLOW_VARIANT"]
+        self.env["REPORTS_DIR"] = os.path.join(
+            flow_home, "reports", platform, design_name, self.env["FLOW_VARIANT"]
         )
-        os.environ["RESULTS_DIR"] = os.path.join(
-            flow_home, "results", platform, design_name, os.environ["FLOW_VARIANT"]
+        self.env["RESULTS_DIR"] = os.path.join(
+            flow_home, "results", platform, design_name, self.env["FLOW_VARIANT"]
         )
 
-        shutil.rmtree(os.path.join(os.environ["OBJECTS_DIR"], "2*"), ignore_errors=True)
-        shutil.rmtree(os.path.join(os.environ["OBJECTS_DIR"], "3*"), ignore_errors=True)
-        shutil.rmtree(os.path.join(os.environ["OBJECTS_DIR"], "4*"), ignore_errors=True)
-        shutil.rmtree(os.path.join(os.environ["OBJECTS_DIR"], "5*"), ignore_errors=True)
-        shutil.rmtree(os.path.join(os.environ["OBJECTS_DIR"], "6*"), ignore_errors=True)
+        # tuned() archives the flow directories of a trial once it has ended,
+        # from the driver, which may run in another working directory
+        if self.env.get("CHATEDA_ARTIFACT_STORE"):
+            trial_store.TrialStore(self.env["CHATEDA_ARTIFACT_STORE"]).register(
+                self.env["CHATEDA_TRIAL_ID"],
+                self.env["FLOW_VARIANT"],
+                {d: os.path.abspath(self.env[d]) for d in trial_store.TRIAL_DIRS},
+            )
+
+        shutil.rmtree(os.path.join(self.env["OBJECTS_DIR"], "2*"), ignore_errors=True)
+        shutil.rmtree(os.path.join(self.env["OBJECTS_DIR"], "3*"), ignore_errors=True)
+        shutil.rmtree(os.path.join(self.env["OBJECTS_DIR"], "4*"), ignore_errors=True)
+        shutil.rmtree(os.path.join(self.env["OBJECTS_DIR"], "5*"), ignore_errors=True)
+        shutil.rmtree(os.path.join(self.env["OBJECTS_DIR"], "6*"), ignore_errors=True)
 
-        os.environ["SYNTH_STOP_MODULE_SCRIPT"] = os.path.join(
-            os.environ["OBJECTS_DIR"], "mark_hier_stop_modules.tcl"
+        self.env["SYNTH_STOP_MODULE_SCRIPT"] = os.path.join(
+            self.env["OBJECTS_DIR"], "mark_hier_stop_modules.tcl"
         )
-        if os.environ["SYNTH_HIERARCHICAL"] == "1":
-            os.environ["HIER_REPORT_SCRIPT"] = os.path.join(
-                os.environ["SCRIPTS_DIR"], "synth_hier_report.tcl"
+        if self.env["SYNTH_HIERARCHICAL"] == "1":
+            self.env["HIER_REPORT_SCRIPT"] = os.path.join(
+                self.env["SCRIPTS_DIR"], "synth_hier_report.tcl"
             )
-            if "MAX_UNGROUP_SIZE" not in os.environ:
-                os.environ["MAX_UNGROUP_SIZE"] = "0"
+            if "MAX_UNGROUP_SIZE" not in self.env:
+                self.env["MAX_UNGROUP_SIZE"] = "0"
 
-        os.environ["NUM_CORES"] = str(os.cpu_count())
+        # tuned() limits NUM_CORES to the CPUs reserved for each trial
+        if "NUM_CORES" not in self.env:
+            self.env["NUM_CORES"] = str(os.cpu_count())
 
         wrapped_lefs = [
             os.path.join(
                 "$(OBJECTS_DIR)/lef",
                 os.path.splitext(os.path.basename(lef))[0] + "_mod.lef",
             )
-            for lef in os.environ.get("WRAP_LEFS", "").split()
+            for lef in self.env.get("WRAP_LEFS", "").split()
             if lef
         ]
         wrapped_libs = [
@@ -160,48 +605,111 @@ class chateda:
                 "$(OBJECTS_DIR)",
                 os.path.splitext(os.path.basename(lib))[0] + "_mod.lib",
             )
-            for lib in os.environ.get("WRAP_LIBS", "").split()
+            for lib in self.env.get("WRAP_LIBS", "").split()
             if lib
         ]
-        os.environ["ADDITIONAL_LEFS"] = " ".join(
-            os.environ.get("ADDITIONAL_LEFS", "").split()
+        self.env["ADDITIONAL_LEFS"] = " ".join(
+            self.env.get("ADDITIONAL_LEFS", "").split()
             + wrapped_lefs
-            + os.environ.get("WRAP_LEFS", "").split()
+            + self.env.get("WRAP_LEFS", "").split()
         )
-        os.environ["LIB_FILES"] = " ".join(
-            os.environ.get("LIB_FILES", "").split()
-            + os.environ.get("WRAP_LIBS", "").split()
+        self.env["LIB_FILES"] = " ".join(
+            self.env.get("LIB_FILES", "").split()
+            + self.env.get("WRAP_LIBS", "").split()
             + wrapped_libs
         )
         dont_use_libs = [
             os.path.join(
-                os.environ["OBJECTS_DIR"],
+                self.env["OBJECTS_DIR"],
                 "lib",
                 os.path.splitext(os.path.basename(lib))[0] + ".lib",
             )
-            for lib in os.environ["LIB_FILES"].split()
+            for lib in self.env["LIB_FILES"].split()
         ]
         dont_use_sc_lib = dont_use_libs[0] if dont_use_libs else None
-        os.environ["DONT_USE_LIBS"] = " ".join(dont_use_libs)
-        os.environ["DONT_USE_SC_LIB"] = dont_use_sc_lib if dont_use_sc_lib else ""
+        self.env["DONT_USE_LIBS"] = " ".join(dont_use_libs)
+        self.env["DONT_USE_SC_LIB"] = dont_use_sc_lib if dont_use_sc_lib else ""
 
         # Create temporary Liberty files which have the proper dont_use properties set
         # For use with Yosys and ABC
-        os.makedirs(os.path.join(os.environ["OBJECTS_DIR"], "lib"), exist_ok=True)
-        dont_use_cells = os.environ["DONT_USE_CELLS"]
-        dont_use_libs = os.environ["DONT_USE_LIBS"].split()
-        for f in os.environ["LIB_FILES"].split():
+        os.makedirs(os.path.join(self.env["OBJECTS_DIR"], "lib"), exist_ok=True)
+        dont_use_libs = self.env["DONT_USE_LIBS"].split()
+        jobs = []
+        for f in self.env["LIB_FILES"].split():
             f_base = os.path.basename(f)
             for dont_use in dont_use_libs:
                 dont_use_base = os.path.basename(dont_use)
                 if f_base == dont_use_base or f_base + ".gz" == dont_use_base:
-                    cmd = f"{os.path.join(os.environ['UTILS_DIR'], 'markDontUse.py')} -p '{dont_use_cells}' -i {f} -o {dont_use}"
-                    print(cmd)
-                    subprocess.run(cmd, shell=True)
+                    jobs.append((f, dont_use))
+        self._make_dont_use_libs(jobs)
+
+        metrics_db = self.env.get(
+            "CHATEDA_METRICS_DB", os.path.join(self.env["WORK_HOME"], "metrics.db")
+        )
+        if self.metrics_store is None or self.metrics_store.path != metrics_db:
+            self.metrics_store = metrics_store.MetricsStore(metrics_db)
 
         print("setup done")
 
+    def _make_dont_use_libs(self, jobs) -> None:
+        """Write the dont_use Liberty file of every (source lib, dont_use lib) job.
+        The files only depend on the source lib and DONT_USE_CELLS, so they are
+        kept in a content-keyed directory shared by all designs and trials of the
+        platform ($DONT_USE_CACHE_DIR). Missing ones are generated in parallel.
+        """
+
+        dont_use_cells = self.env["DONT_USE_CELLS"]
+        mark_dont_use = os.path.join(self.env["UTILS_DIR"], "markDontUse.py")
+        cache_dir = self.env.get(
+            "DONT_USE_CACHE_DIR",
+            os.path.join(
+                self.env["WORK_HOME"], "objects", self.env["PLATFORM"], "dont_use_libs"
+            ),
+        )
+        os.makedirs(cache_dir, exist_ok=True)
+
+        def mark(f, out):
+            cmd = f"{mark_dont_use} -p '{dont_use_cells}' -i {f} -o {out}"
+            print(cmd)
+            subprocess.run(cmd, shell=True, env=self.env)
+
+        def generate(f, cached):
+            tmp = os.path.join(
+                cache_dir,
+                f".tmp-{os.getpid()}-{threading.get_ident()}-"
+                + os.path.basename(cached),
+            )
+            mark(f, tmp)
+            if os.path.isfile(tmp):
+                os.replace(tmp, cached)
+
+        cached_libs, misses = [], []
+        for f, dont_use in jobs:
+            if not os.path.isfile(f):
+                # let markDontUse report the missing lib as before
+                mark(f, dont_use)
+                continue
+            h = hashlib.sha256()
+            h.update(stage_cache.file_digest(f).encode())
+            h.update(dont_use_cells.encode())
+            if os.path.isfile(mark_dont_use):
+                h.update(stage_cache.file_digest(mark_dont_use).encode())
+            cached = os.path.join(
+                cache_dir, h.hexdigest()[:32] + "-" + os.path.basename(dont_use)
+            )
+            cached_libs.append((cached, dont_use))
+            if not os.path.isfile(cached) and (f, cached) not in misses:
+                misses.append((f, cached))
+
+        if misses:
+            with ThreadPoolExecutor(max_workers=len(misses)) as pool:
+                list(pool.map(lambda job: generate(*job), misses))
+        for cached, dont_use in cached_libs:
+            if os.path.isfile(cached):
+                self._publish(cached, dont_use)
+
     # Synthesis
+    @_stage_steps
     def run_synthesis(self, clock_period: int = None, abc_area: bool = False):
         """Run logic synthesis.
         Logic synthesis can't be executed without setting up.
@@ -211,59 +719,127 @@ class chateda:
         """
 
         if clock_period is not None:
-            os.environ["ABC_CLOCK_PERIOD_IN_PS"] = str(clock_period)
-            with open(os.environ["DESIGN_DIR"] + "/constraint.sdc", "r") as f:
-                lines = f.readlines()
-            with open(os.environ["DESIGN_DIR"] + "/constraint.sdc", "w") as new_f:
-                for line in lines:
-                    if "set clk_period" in line:
-                        new_f.write(f"set clk_period {clock_period}\n")
-                    else:
-                        new_f.write(line)
-        os.environ["ABC_AREA"] = "1" if abc_area else "0"
-        synth_script = os.path.join(os.environ["SCRIPTS_DIR"], "synth.tcl")
-        results_dir = os.environ["RESULTS_DIR"]
-        log_dir = os.environ["LOG_DIR"]
+            self.env["ABC_CLOCK_PERIOD_IN_PS"] = str(clock_period)
+            self.sdc_vars["clk_period"] = clock_period
+        self.env["ABC_AREA"] = "1" if abc_area else "0"
+        synth_script = os.path.join(self.env["SCRIPTS_DIR"], "synth.tcl")
+        results_dir = self.env["RESULTS_DIR"]
+        log_dir = self.env["LOG_DIR"]
         os.makedirs(results_dir, exist_ok=True)
         os.makedirs(log_dir, exist_ok=True)
-        os.makedirs(os.environ["REPORTS_DIR"], exist_ok=True)
+        os.makedirs(self.env["REPORTS_DIR"], exist_ok=True)
+        # overrides go to this run's own copy of the SDC, so concurrent flows
+        # of the design don't race on its constraint.sdc
+        self.env["SDC_FILE"] = self._sdc_source
+        if self.sdc_vars:
+            self.env["SDC_FILE"] = sdc_overlay.write(
+                self._sdc_source, results_dir, self.sdc_vars
+            )
+        if (yield ("restore", "synth")):
+            print("run_synthesis done")
+            return
 
-        if os.environ["SYNTH_HIERARCHICAL"] == "1":
+        if self.env["SYNTH_HIERARCHICAL"] == "1":
             yosys_cmd = " ".join(
                 [
                     self.yosys_cmd,
                     self.yosys_flags,
-                    "-c " + os.environ["HIER_REPORT_SCRIPT"],
+                    "-c " + self.env["HIER_REPORT_SCRIPT"],
                 ]
             )
             cmd = self.time_cmd + " " + yosys_cmd
+            yield (
+                "cmd",
+                cmd,
+                os.path.join(log_dir, "1_1_yosys_hier_report.log"),
+                "synth_hier_report.tcl",
+            )
 
-            with open(
-                os.path.join(log_dir, "1_1_yosys_hier_report.log"), "w"
-            ) as log_file:
-                subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT)
-
-        cmd = " ".join(
-            [self.time_cmd, self.yosys_cmd, self.yosys_flags, "-c " + synth_script]
-        )
-        print(cmd)
-        with open(os.path.join(log_dir, "1_1_yosys.log"), "w") as log_file:
-            result = subprocess.run(
-                cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True
+        partitions = []
+        if self.env["SYNTH_HIERARCHICAL"] == "1" and self.env["SYNTH_PARALLEL"] == "1":
+            partitions = synth_partition.partitions(self.env)
+        if partitions:
+            self._stage_status = yield from self._synth_partitions(partitions)
+        else:
+            cmd = " ".join(
+                [self.time_cmd, self.yosys_cmd, self.yosys_flags, "-c " + synth_script]
+            )
+            print(cmd)
+            self._stage_status = yield (
+                "cmd",
+                cmd,
+                os.path.join(log_dir, "1_1_yosys.log"),
+                "synth.tcl",
             )
-            self._print(result.stdout)
-            log_file.write(result.stdout.decode())
 
-        shutil.copy(
+        self._publish(
             os.path.join(results_dir, "1_1_yosys.v"),
             os.path.join(results_dir, "1_synth.v"),
         )
 
-        shutil.copy(os.environ["SDC_FILE"], os.path.join(results_dir, "1_synth.sdc"))
-        
+        shutil.copy(self.env["SDC_FILE"], os.path.join(results_dir, "1_synth.sdc"))
+        yield ("store", "synth")
+
         print("run_synthesis done")
 
+    def _synth_partitions(self, partitions):
+        """Steps of a parallel hierarchical synthesis. Every partition runs in its
+        own yosys, unless one with the same sources and knobs was synthesized
+        before ($SYNTH_PARTITION_DIR keeps them), and the partition netlists are
+        stitched into 1_1_yosys.v. Returns the first nonzero exit status, or 0.
+        """
+
+        part_dir = self.env.get(
+            "SYNTH_PARTITION_DIR",
+            os.path.join(
+                self.env["WORK_HOME"],
+                "objects",
+                self.env["PLATFORM"],
+                "synth_partitions",
+            ),
+        )
+        os.makedirs(part_dir, exist_ok=True)
+        synth_script = os.path.join(self.env["SCRIPTS_DIR"], "synth.tcl")
+        netlists, jobs, pending = [], [], []
+        for module, _, env in partitions:
+            done = os.path.join(
+                part_dir, module + "-" + stage_cache.stage_key("synth", env)[:32]
+            )
+            netlists.append(os.path.join(done, "1_1_yosys.v"))
+            if os.path.isfile(netlists[-1]):
+                print(f"synthesis of {module} reused")
+                continue
+            work = tempfile.mkdtemp(dir=part_dir, prefix=".tmp-")
+            env.update(RESULTS_DIR=work, REPORTS_DIR=work, OBJECTS_DIR=work)
+            cmd = " ".join(
+                [self.time_cmd, self.yosys_cmd, self.yosys_flags, "-c " + synth_script]
+            )
+            print(cmd)
+            log_to = os.path.join(self.env["LOG_DIR"], f"1_1_yosys_{module}.log")
+            jobs.append((cmd, log_to, "synth.tcl", env))
+            pending.append((work, done))
+
+        statuses = []
+        if jobs:
+            statuses = yield ("cmds", jobs, int(self.env["NUM_CORES"]))
+        for status, (work, done) in zip(statuses, pending):
+            if status == 0 and os.path.isfile(os.path.join(work, "1_1_yosys.v")):
+                try:
+                    os.rename(work, done)
+                    continue
+                except OSError:
+                    # another flow synthesized the same partition first
+                    pass
+            shutil.rmtree(work, ignore_errors=True)
+        status = next((s for s in statuses if s != 0), 0)
+        if status == 0:
+            synth_partition.stitch(
+                netlists, os.path.join(self.env["RESULTS_DIR"], "1_1_yosys.v")
+            )
+        return status
+
     # Floorplan
+    @_stage_steps
     def floorplan(
         self,
         netlist: str = None,
@@ -285,52 +861,62 @@ class chateda:
         """
 
         if core_utilization is not None:
-            os.environ["CORE_UTILIZATION"] = str(core_utilization)
+            self.env["CORE_UTILIZATION"] = str(core_utilization)
             if core_aspect_ratio is not None:
-                os.environ["CORE_ASPECT_RATIO"] = str(core_aspect_ratio)
+                self.env["CORE_ASPECT_RATIO"] = str(core_aspect_ratio)
             if core_margins is not None:
-                os.environ["CORE_MARGINS"] = str(core_margins)
+                self.env["CORE_MARGINS"] = str(core_margins)
         if macro_place_halo is not None:
-            os.environ["MACRO_PLACE_HALO"] = str(macro_place_halo)
+            self.env["MACRO_PLACE_HALO"] = str(macro_place_halo)
         if macro_place_channel is not None:
-            os.environ["MACRO_PLACE_CHANNEL"] = str(macro_place_channel)
-        results_dir = os.environ["RESULTS_DIR"]
+            self.env["MACRO_PLACE_CHANNEL"] = str(macro_place_channel)
+        results_dir = self.env["RESULTS_DIR"]
+        if (yield ("restore", "floorplan")):
+            self._report_stage("floorplan")
+            print("floorplan done")
+            return
 
         # STEP 1: Translate verilog to odb
-        self._run_ord_cmd("floorplan.tcl", "2_1_floorplan.json", "2_1_floorplan.log")
+        yield ("ord", "floorplan.tcl", "2_1_floorplan.json", "2_1_floorplan.log")
 
         # STEP 2: IO Placement (random)
-        self._run_ord_cmd(
-            "io_placement_random.tcl", "2_2_floorplan_io.json", "2_2_floorplan_io.log"
+        yield (
+            "ord",
+            "io_placement_random.tcl",
+            "2_2_floorplan_io.json",
+            "2_2_floorplan_io.log",
         )
 
         # STEP 3: Timing Driven Mixed Sized Placement
-        if "MACRO_PLACEMENT" not in os.environ:
-            self._run_ord_cmd("tdms_place.tcl", "2_3_tdms.json", "2_3_tdms_place.log")
+        if "MACRO_PLACEMENT" not in self.env:
+            yield ("ord", "tdms_place.tcl", "2_3_tdms.json", "2_3_tdms_place.log")
         else:
-            print("Using manual macro placement file " + os.environ["MACRO_PLACEMENT"])
-            shutil.copy(
+            print("Using manual macro placement file " + self.env["MACRO_PLACEMENT"])
+            self._publish(
                 os.path.join(results_dir, "2_2_floorplan_io.odb"),
                 os.path.join(results_dir, "2_3_floorplan_tdms.odb"),
             )
 
         # STEP 4: Macro Placement
-        self._run_ord_cmd("macro_place.tcl", "2_4_mplace.json", "2_4_mplace.log")
+        yield ("ord", "macro_place.tcl", "2_4_mplace.json", "2_4_mplace.log")
 
         # STEP 5: Tapcell and Welltie insertion
-        self._run_ord_cmd("tapcell.tcl", "2_5_tapcell.json", "2_5_tapcell.log")
+        yield ("ord", "tapcell.tcl", "2_5_tapcell.json", "2_5_tapcell.log")
 
         # STEP 6: PDN generation
-        self._run_ord_cmd("pdn.tcl", "2_6_pdn.json", "2_6_pdn.log")
+        yield ("ord", "pdn.tcl", "2_6_pdn.json", "2_6_pdn.log")
 
-        shutil.copy(
+        self._publish(
             os.path.join(results_dir, "2_6_floorplan_pdn.odb"),
             os.path.join(results_dir, "2_floorplan.odb"),
         )
+        yield ("store", "floorplan")
+        self._report_stage("floorplan")
 
         print("floorplan done")
 
     # Place
+    @_stage_steps
     def placement(self, design: str = None, density: float = None):
         """Run placement.
         Placement can't be executed without performing floorplanning.
@@ -340,11 +926,16 @@ class chateda:
         """
 
         if density is not None:
-            os.environ["PLACE_DENSITY"] = str(density)
-        results_dir = os.environ["RESULTS_DIR"]
+            self.env["PLACE_DENSITY"] = str(density)
+        results_dir = self.env["RESULTS_DIR"]
+        if (yield ("restore", "place")):
+            self._report_stage("place")
+            print("placement done")
+            return 0
 
         # STEP 1: Global placement without placed IOs, timing-driven, and routability-driven.
-        status = self._run_ord_cmd(
+        status = yield (
+            "ord",
             "global_place_skip_io.tcl",
             "3_1_place_gp_skip_io.json",
             "3_1_place_gp_skip_io.log",
@@ -353,41 +944,49 @@ class chateda:
             return status
 
         # STEP 2: IO placement (non-random)
-        status = self._run_ord_cmd(
-            "io_placement.tcl", "3_2_place_iop.json", "3_2_place_iop.log"
+        status = yield (
+            "ord",
+            "io_placement.tcl",
+            "3_2_place_iop.json",
+            "3_2_place_iop.log",
         )
         if status != 0:
             return status
 
         # STEP 3: Global placement with placed IOs, timing-driven, and routability-driven.
-        status = self._run_ord_cmd(
-            "global_place.tcl", "3_3_place_gp.json", "3_3_place_gp.log"
+        status = yield (
+            "ord",
+            "global_place.tcl",
+            "3_3_place_gp.json",
+            "3_3_place_gp.log",
         )
         if status != 0:
             return status
 
         # STEP 4: Resizing & Buffering
-        status = self._run_ord_cmd("resize.tcl", "3_4_resizer.json", "3_4_resizer.log")
+        status = yield ("ord", "resize.tcl", "3_4_resizer.json", "3_4_resizer.log")
         if status != 0:
             return status
 
         # STEP 5: Detail placement
-        status = self._run_ord_cmd(
-            "detail_place.tcl", "3_5_opendp.json", "3_5_opendp.log"
-        )
+        status = yield ("ord", "detail_place.tcl", "3_5_opendp.json", "3_5_opendp.log")
 
-        shutil.copy(
+        self._publish(
             os.path.join(results_dir, "3_5_place_dp.odb"),
             os.path.join(results_dir, "3_place.odb"),
         )
-        shutil.copy(
+        self._publish(
             os.path.join(results_dir, "2_floorplan.sdc"),
             os.path.join(results_dir, "3_place.sdc"),
         )
+        yield ("store", "place")
+        self._report_stage("place")
 
         print("placement done")
+        return status
 
     # CTS
+    @_stage_steps
     def cts(self, design: str = None, tns_end_percent: int = 20):
         """Run clock tree synthesis.
         CTS can't be executed without performing placement.
@@ -396,20 +995,25 @@ class chateda:
             tns_end_percent(float) -- Specifies how many percent of violating paths to fix [0-100]. Worst path will always be fixed
         """
 
-        os.environ["TNS_END_PERCENT"] = str(tns_end_percent)
-        self._run_ord_cmd("cts.tcl", "4_1_cts.json", "4_1_cts.log")
-        self._run_ord_cmd(
-            "fillcell.tcl", "4_2_cts_fillcell.json", "4_2_cts_fillcell.log"
-        )
-        results_dir = os.environ["RESULTS_DIR"]
-        shutil.copy(
+        self.env["TNS_END_PERCENT"] = str(tns_end_percent)
+        if (yield ("restore", "cts")):
+            self._report_stage("cts")
+            print("cts done")
+            return
+        yield ("ord", "cts.tcl", "4_1_cts.json", "4_1_cts.log")
+        yield ("ord", "fillcell.tcl", "4_2_cts_fillcell.json", "4_2_cts_fillcell.log")
+        results_dir = self.env["RESULTS_DIR"]
+        self._publish(
             os.path.join(results_dir, "4_2_cts_fillcell.odb"),
             os.path.join(results_dir, "4_cts.odb"),
         )
+        yield ("store", "cts")
+        self._report_stage("cts")
 
         print("cts done")
 
     # Route
+    @_stage_steps
     def global_route(self, design: str = None):
         """Run global routing.
         Global routing can't be executed without performing CTS.
@@ -417,12 +1021,24 @@ class chateda:
             design(str) --  The path to the lef file with CTS. If it's set to None, the lef file with CTS will be read in the default path.
         """
 
-        status = self._run_ord_cmd(
-            "global_route.tcl", "5_1_fastroute.json", "5_1_fastroute.log"
+        if (yield ("restore", "global_route")):
+            self._report_stage("global_route")
+            print("global_route done")
+            return 0
+        status = yield (
+            "ord",
+            "global_route.tcl",
+            "5_1_fastroute.json",
+            "5_1_fastroute.log",
         )
-        
+        yield ("store", "global_route")
+        if status == 0:
+            self._report_stage("global_route")
+
         print("global_route done")
+        return status
 
+    @_stage_steps
     def detail_route(self, design: str = None):
         """Run detail routing.
         Detail routing can't be executed without performing global routing.
@@ -430,55 +1046,70 @@ class chateda:
             design(str) --  The path to the global routed lef file. If it's set to None, the global routed lef file will be read in the default path.
         """
 
-        self._run_ord_cmd(
-            "detail_route.tcl", "5_2_TritonRoute.json", "5_2_TritonRoute.log"
-        )
-        results_dir = os.environ["RESULTS_DIR"]
-        shutil.copy(
+        if (yield ("restore", "detail_route")):
+            print("detail_route done")
+            return
+        yield ("ord", "detail_route.tcl", "5_2_TritonRoute.json", "5_2_TritonRoute.log")
+        results_dir = self.env["RESULTS_DIR"]
+        self._publish(
             os.path.join(results_dir, "5_2_route.odb"),
             os.path.join(results_dir, "5_route.odb"),
         )
-        shutil.copy(
+        self._publish(
             os.path.join(results_dir, "4_cts.sdc"),
             os.path.join(results_dir, "5_route.sdc"),
         )
+        yield ("store", "detail_route")
 
         print("detail_route done")
 
     # Finishing
+    @_stage_steps
     def density_fill(self):
         """Run density fill.
         Density fill can't be executed without performing routing.
         """
 
-        if os.environ.get("DENSITY_FILL", "") != "":
-            self._run_ord_cmd(
-                "density_fill.tcl", "6_density_fill.json", "6_density_fill.log"
+        if (yield ("restore", "density_fill")):
+            print("density_fill done")
+            return
+        if self.env.get("DENSITY_FILL", "") != "":
+            yield (
+                "ord",
+                "density_fill.tcl",
+                "6_density_fill.json",
+                "6_density_fill.log",
             )
         else:
-            shutil.copy(
-                os.path.join(os.environ["RESULTS_DIR"], "5_route.odb"),
-                os.path.join(os.environ["RESULTS_DIR"], "6_1_fill.odb"),
+            self._publish(
+                os.path.join(self.env["RESULTS_DIR"], "5_route.odb"),
+                os.path.join(self.env["RESULTS_DIR"], "6_1_fill.odb"),
             )
+        yield ("store", "density_fill")
 
         print("density_fill done")
 
     # Finishing
+    @_stage_steps
     def final_report(self):
         """Run final report.
         Final report can't be executed without performing density fill.
         """
 
-        self._run_ord_cmd("final_report.tcl", "6_report.json", "6_report.log")
-        results_dir = os.environ["RESULTS_DIR"]
-        shutil.copy(
+        if (yield ("restore", "final_report")):
+            print("final_report done")
+            return
+        yield ("ord", "final_report.tcl", "6_report.json", "6_report.log")
+        results_dir = self.env["RESULTS_DIR"]
+        self._publish(
             os.path.join(results_dir, "5_route.sdc"),
             os.path.join(results_dir, "6_1_fill.sdc"),
         )
-        shutil.copy(
+        self._publish(
             os.path.join(results_dir, "5_route.sdc"),
             os.path.join(results_dir, "6_final.sdc"),
         )
+        yield ("store", "final_report")
 
         print("final_report done")
 
@@ -495,106 +1126,263 @@ class chateda:
             metrics(list(str)) -- The concerned metrics provided in a list.
             Available values are: "tns", "wns", "area", "power", "performance". 
         Return:
-            metric(float) -- The value of metrics. The smaller the better.
+            metric(float) -- The value of metrics. The smaller the better. None if the stage's metric file doesn't exist (yet).
         """
 
-        # Note: the following implementation is generated by copilet
-        # UNTESTED, but looks awesome
-        stage_file = ""
-        if stage == "floorplan":
-            stage_file = "2_1_floorplan"
-        elif stage == "final":
-            stage = "finish"
-            stage_file = "6_report"
-        for metric in metrics:
-            if metric == "tns":
-                metric = stage + "__timing__setup__ts"
-            elif metric == "wns":
-                metric = stage + "__timing__setup__ws"
-            elif metric == "area":
-                metric = stage + "__design__core__area"
-            elif metric == "power":
-                metric = stage + "__power__total"
-            elif metric == "performance":
-                metric = stage + "__performance"
-
+        if isinstance(metrics, str):
+            metrics = [metrics]
+        stage_file, prefix = STAGE_METRICS[stage]
+        data = self._load_metrics(stage_file + ".json")
+        if data is None:
+            path = os.path.join(self.env["LOG_DIR"], stage_file + ".json")
+            print(f"get_metric: no metrics of {stage}, {path} is missing")
+            return None
         m = 0
-        with open(os.path.join(os.environ["LOG_DIR"], stage_file + ".json")) as f:
-            data = json.load(f)
         for metric in metrics:
-            m += data[metric]
+            m += data[prefix + METRIC_SUFFIX.get(metric, "__" + metric)]
         m /= len(metrics)
 
         print("get_metric done")
         return m
 
+    @_stage_steps
     def run_all(self):
-        self._run_ord_cmd("run_all.tcl", "run_all.json", "run_all.log")
+        self._stage = "run_all"
+        self._start_limits()
+        # run_all.tcl rewrites the outputs of every stage after synthesis
+        self._unlink_outputs(s for s in stage_cache.STAGES if s != "synth")
+        yield ("ord", "run_all.tcl", "run_all.json", "run_all.log")
 
     def _run_ord_cmd(self, script: str, metric: str, log_to: str):
-        cmd = " ".join(
+        if self.ord_session is not None:
+            status = self._run_ord_session(script, metric, log_to)
+            if status == ord_session.STALE:
+                # another design than the one in memory: start over
+                status = self._run_ord_session(script, metric, log_to)
+            if status == 0 or self._limit_hit is not None:
+                return self._ord_cmd_done(status, metric)
+            print(f"{script} failed in the OpenROAD session, rerunning it")
+        cmd = self._ord_cmd_line(script, metric)
+        print(cmd)
+        status = self._run_cmd(cmd, os.path.join(self.env["LOG_DIR"], log_to), script)
+        return self._ord_cmd_done(status, metric)
+
+    def _ord_cmd_line(self, script: str, metric: str) -> str:
+        return " ".join(
             [
                 self.time_cmd,
                 self.ord_cmd,
-                os.path.join(os.environ["SCRIPTS_DIR"], script),
+                os.path.join(self.env["SCRIPTS_DIR"], script),
                 "-metrics",
-                os.path.join(os.environ["LOG_DIR"], metric),
+                os.path.join(self.env["LOG_DIR"], metric),
             ]
         )
-        print(cmd)
-        with open(os.path.join(os.environ["LOG_DIR"], log_to), "w") as log_file:
-            result = subprocess.run(
-                cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True
-            )
-            self._print(result.stdout)
-            log_file.write(result.stdout.decode())
+
+    def _ord_cmd_done(self, status: int, metric: str) -> int:
+        self._stage_status = self._stage_status or status
+        self._load_metrics(metric)
         print("Done.", flush=True)
-        return result.returncode
+        return status
+
+    def _run_ord_session(self, script: str, metric: str, log_to: str) -> int:
+        script_path = os.path.join(self.env["SCRIPTS_DIR"], script)
+        log_to = os.path.join(self.env["LOG_DIR"], log_to)
+        print("session: source " + script_path)
+        with self._admitted(log_to):
+            start = time.time()
+            proc = self.ord_session.process(self.env)
+            with open(log_to, "w") as log_file, self._watchdog(proc) as watchdog:
+
+                def output(line):
+                    log_file.write(line)
+                    self._output(line)
+
+                metrics = os.path.join(self.env["LOG_DIR"], metric)
+                status = self.ord_session.run(script_path, metrics, self.env, output)
+            if watchdog.reason is not None:
+                self.ord_session.close()
+            status = self._limited(watchdog, status, log_to)
+            # the interpreter outlives the step, so only its wall time is known
+            self._record_step(log_to, script, start, status, None)
+            return status
 
+    def _report_stage(self, stage: str) -> None:
+        """Report the PPA of a finished stage to the running Ray Tune trial.
+        tuned() turns this on with $CHATEDA_REPORT_STAGES, so schedulers can stop
+        hopeless trials before the expensive routing stages. Results carry
+        "stage_index", the position of the stage in REPORTED_STAGES plus one.
+        A metric missing from the stage's JSON is reported as its WORST_METRICS
+        value, so every result has the objectives the schedulers compare.
+        """
 
-def tuned(func, param):
+        if self.env.get("CHATEDA_REPORT_STAGES") != "1":
+            return
+        stage_file, prefix = STAGE_METRICS[stage]
+        data = self._load_metrics(stage_file + ".json") or {}
+        result = {"stage": stage, "stage_index": REPORTED_STAGES.index(stage) + 1}
+        for metric in ("area", "power", "wns"):
+            value = data.get(prefix + METRIC_SUFFIX[metric])
+            if not isinstance(value, (int, float)):
+                value = WORST_METRICS[metric]
+            result[metric] = value
+        # only trials set CHATEDA_REPORT_STAGES, and they have Ray loaded
+        from ray.air import session
+
+        session.report(result)
+
+    def _load_metrics(self, metric: str):
+        """Metrics of a step's JSON in LOG_DIR, indexed into the metrics store on first read.
+        Parsed files are kept in memory until the file changes.
+        """
+
+        path = os.path.join(self.env["LOG_DIR"], metric)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        memo = self._metrics.get(path)
+        if memo is not None and memo[0] == mtime:
+            return memo[1]
+        try:
+            if self.metrics_store is not None:
+                data = self.metrics_store.ingest(
+                    path,
+                    design=self.env["DESIGN_NAME"],
+                    platform=self.env["PLATFORM"],
+                    variant=self.env["FLOW_VARIANT"],
+                    trial=self.env.get("CHATEDA_TRIAL_ID", ""),
+                    stage=os.path.splitext(metric)[0],
+                )
+            else:
+                with open(path) as f:
+                    data = json.load(f)
+        except ValueError:
+            return None
+        self._metrics[path] = (mtime, data)
+        return data
+
+
+class async_chateda(chateda):
+    """chateda with awaitable stages: `await flow.placement(density=0.6)`.
+    Tools run as asyncio subprocesses whose output is streamed line by line to
+    the log file and on_output, so one event loop can supervise many flows,
+    one instance per flow. Cancelling a stage kills the running tool with its
+    whole process group. setup() and get_metric() stay blocking; the
+    persistent OpenROAD session is not used.
+    """
+
+    def _drive(self, steps):
+        return self._adrive(steps)
+
+    async def _adrive(self, steps):
+        result = None
+        try:
+            while True:
+                try:
+                    step = steps.send(result)
+                except StopIteration as stop:
+                    # stages that fail early return before their "store" step
+                    self._release_stage_lock()
+                    return stop.value
+                result = await self._arun_step(*step)
+                if self._limit_hit is not None:
+                    return self._stop_at_limit(steps)
+        except BaseException:
+            steps.close()
+            self._release_stage_lock()
+            raise
+
+    async def _arun_step(self, kind: str, *args):
+        if kind == "restore":
+            # waiting for the cache lock of a flow in this same loop must not block the loop
+            return await asyncio.to_thread(self._restore_stage, *args)
+        if kind == "store":
+            return await asyncio.to_thread(self._store_stage, *args)
+        if kind == "ord":
+            return await self._arun_ord_cmd(*args)
+        if kind == "cmds":
+            return await self._arun_cmds(*args)
+        return await self._arun_cmd(*args)
+
+    async def _arun_cmds(self, jobs, workers: int) -> list:
+        limit = asyncio.Semaphore(max(1, workers))
+
+        async def run(job):
+            async with limit:
+                return await self._arun_cmd(*job)
+
+        return list(await asyncio.gather(*(run(job) for job in jobs)))
+
+    async def _arun_ord_cmd(self, script: str, metric: str, log_to: str) -> int:
+        cmd = self._ord_cmd_line(script, metric)
+        print(cmd)
+        status = await self._arun_cmd(
+            cmd, os.path.join(self.env["LOG_DIR"], log_to), script
+        )
+        return self._ord_cmd_done(status, metric)
+
+    async def _arun_cmd(
+        self, cmd: str, log_to: str, script: str = None, env=None
+    ) -> int:
+        if self.admission is None:
+            return await self._arun_tool(cmd, log_to, script, env)
+        step = os.path.splitext(os.path.basename(log_to))[0]
+        grant = self.admission.try_acquire(step)
+        while grant is None:
+            await asyncio.sleep(self.admission.poll_s)
+            grant = self.admission.try_acquire(step)
+        with self._granted(grant, env):
+            return await self._arun_tool(cmd, log_to, script, env)
+
+    async def _arun_tool(
+        self, cmd: str, log_to: str, script: str = None, env=None
+    ) -> int:
+        start = time.time()
+        timing = None
+        proc = await asyncio.create_subprocess_shell(
+            cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=self.env if env is None else env,
+            # the shell, time and the tool form one group that is killed together
+            start_new_session=True,
+        )
+        try:
+            with open(log_to, "w") as log_file, self._watchdog(proc) as watchdog:
+                async for line in proc.stdout:
+                    line = line.decode(errors="replace")
+                    log_file.write(line)
+                    self._output(line)
+                    if line.startswith("Elapsed time:"):
+                        timing = step_trace.parse_time_line(line)
+            status = await proc.wait()
+        except BaseException:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+            self._record_step(log_to, script, start, proc.returncode, timing)
+            raise
+        status = self._limited(watchdog, status, log_to)
+        self._record_step(log_to, script, start, status, timing)
+        return status
+
+
+def tuned(func, param, *args, **kwargs):
     """parameter tuning.
-    Keyword parameters:
-        func -- A function that runs the target flow and return a metric for parameter tuning.
-        The function should take to-be-tuned parameters as its function parameters.
-        The function should return the concerned results as its return value.
-        param -- The flow parameters to be tuned.
-        Param should be a dictionary with the following format:
-        { param_name: {"minmax": [min, max], "step": step} }
-        # The data type of min, max and step is required to be int or float
+    See dse_tune.tuned for the keyword parameters. Ray Tune and Optuna are
+    imported on the first call, so flows that don't tune start without them.
     """
 
-    param_space = {}
-    for name, para in param.items():
-        param_space[name] = tune.quniform(
-            para["minmax"][0], para["minmax"][1], para["step"]
-        )
-    searcher = OptunaSearch(metric=["area", "power"], mode=["min", "min"])
-    algo = ConcurrencyLimiter(searcher, max_concurrent=1)
-
-    tuner = tune.Tuner(
-        tune.with_resources(func, resources={"cpu": 1, "gpu": 0}),
-        tune_config=tune.TuneConfig(
-            search_alg=algo, max_concurrent_trials=1, num_samples=20
-        ),
-        run_config=RunConfig(
-            stop={"time_total_s": 600},  # 100 seconds
-        ),
-        param_space=param_space,
-    )
-    results = tuner.fit()
-    print(
-        "Best hyperparameters found for area were: ",
-        results.get_best_result("area", "min").config,
-    )
-    print(
-        "Best hyperparameters found for power were: ",
-        results.get_best_result("power", "min").config,
-    )
-    print("tune done")
+    import dse_tune
+
+    return dse_tune.tuned(func, param, *args, **kwargs)
 
 
 if __name__ == "__main__":
+    from ray.air import session
+
     # ceda = chateda()
     # ceda.setup(
     #     "aes",
@@ -643,20 +1431,22 @@ if __name__ == "__main__":
         print("\n\n\n before final report\n\n\n")
         ceda.final_report()
         print("\n\n\n after final report\n\n\n", flush=True)
-        area = ceda.get_metric("final", "area")
-        power = ceda.get_metric("final", "power")
-        wns = ceda.get_metric("final", "wns")
-        session.report({"area": area, "power": power, "wns": wns})
+        result = {}
+        for metric, worst in WORST_METRICS.items():
+            value = ceda.get_metric("final", metric)
+            result[metric] = worst if value is None else value
+        session.report(result)
 
     tuned(
         tune_synth,
         {
-            "util": {"minmax": [60, 90], "step": 10},
-            "ratio": {"minmax": [0.8, 1.2], "step": 0.1},
-            "margins": {"minmax": [8, 12], "step": 1},
-            "halo": {"minmax": [5, 9], "step": 1},
-            "channel": {"minmax": [7, 11], "step": 1},
-            "density": {"minmax": [0.6, 0.9], "step": 0.1},
-            "tns_p": {"minmax": [30, 50], "step": 5},
+            "util": {"minmax": [60, 90], "step": 10, "stage": "floorplan"},
+            "ratio": {"minmax": [0.8, 1.2], "step": 0.1, "stage": "floorplan"},
+            "margins": {"minmax": [8, 12], "step": 1, "stage": "floorplan"},
+            "halo": {"minmax": [5, 9], "step": 1, "stage": "floorplan"},
+            "channel": {"minmax": [7, 11], "step": 1, "stage": "floorplan"},
+            "density": {"minmax": [0.6, 0.9], "step": 0.1, "stage": "place"},
+            "tns_p": {"minmax": [30, 50], "step": 5, "stage": "cts"},
         },
+        prefix_tree=True,
     )
\ No newline at end of file
@@ -0,0 +1,212 @@
+import inspect
+import json
+import sys
+import types
+
+import openroad_api
+
+# Flow stages in order; a stage needs the one before it since the last setup()
+FLOW = [
+    "setup",
+    "run_synthesis",
+    "floorplan",
+    "placement",
+    "cts",
+    "global_route",
+    "detail_route",
+    "density_fill",
+    "final_report",
+]
+# Flow stage every get_metric() stage needs
+METRIC_STAGES = {
+    "floorplan": "floorplan",
+    "place": "placement",
+    "cts": "cts",
+    "route": "detail_route",
+    "final": "final_report",
+}
+METRICS = ["tns", "wns", "area", "power", "performance"]
+# Bounds on what a trace keeps of long-running (e.g. grid search) scripts
+MAX_CALLS = 200000
+MAX_FLOWS = 32
+MAX_VALUES = 64
+MAX_ERRORS = 16
+
+
+class Truncated(BaseException):
+    """Raised into a script once its trace holds MAX_CALLS calls."""
+
+
+class Trace:
+    """What a script did with the chateda API.
+
+    to_json() gives:
+        flows      -- the [method, args] sequence of the first MAX_FLOWS chateda instances
+        values     -- distinct values passed, by "method.param" (e.g. "placement.density")
+        metrics    -- metric names get_metric() was asked for, by metric stage
+        last_stage -- the furthest flow stage any instance reached
+        errors     -- flow order and argument violations, e.g. a stage run before its predecessor
+        calls, flow_count, tune_calls, truncated
+    """
+
+    def __init__(self) -> None:
+        self.flows = []
+        self.values = {}
+        self.metrics = {}
+        self.last_stage = -1
+        self.errors = []
+        self.calls = 0
+        self.flow_count = 0
+        self.tune_calls = 0
+        self.truncated = False
+
+    def new_flow(self) -> int:
+        self.flow_count += 1
+        if len(self.flows) < MAX_FLOWS:
+            self.flows.append([])
+        return self.flow_count - 1
+
+    def call(self, flow: int, method: str, args: dict) -> None:
+        self.calls += 1
+        if self.calls > MAX_CALLS:
+            self.truncated = True
+            raise Truncated()
+        if 0 <= flow < len(self.flows):
+            self.flows[flow].append([method, args])
+        for name, value in args.items():
+            values = self.values.setdefault(f"{method}.{name}", [])
+            if len(values) < MAX_VALUES and value not in values:
+                values.append(value)
+
+    def error(self, message: str) -> None:
+        if len(self.errors) < MAX_ERRORS and message not in self.errors:
+            self.errors.append(message)
+
+    def to_json(self) -> dict:
+        return {
+            "flows": self.flows,
+            "values": self.values,
+            "metrics": {k: sorted(v) for k, v in self.metrics.items()},
+            "last_stage": FLOW[self.last_stage] if self.last_stage >= 0 else None,
+            "errors": self.errors,
+            "calls": self.calls,
+            "flow_count": self.flow_count,
+            "tune_calls": self.tune_calls,
+            "truncated": self.truncated,
+        }
+
+
+# Trace of the script running in this process
+_trace = Trace()
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    try:
+        return json.loads(json.dumps(value))
+    except (TypeError, ValueError):
+        return repr(value)
+
+
+def _traced(name):
+    api = getattr(openroad_api.chateda, name)
+    signature = inspect.signature(api)
+    index = FLOW.index(name) if name in FLOW else None
+
+    def method(self, *args, **kwargs):
+        # a call the stub wouldn't accept fails the same way
+        bound = signature.bind(self, *args, **kwargs)
+        passed = {k: _json_value(v) for k, v in bound.arguments.items() if k != "self"}
+        _trace.call(self._flow, name, passed)
+        if index is None:
+            return
+        if index > self._done + 1:
+            _trace.error(f"{name} run before {FLOW[index - 1]}")
+        # rerunning a stage invalidates the stages after it
+        self._done = index
+        _trace.last_stage = max(_trace.last_stage, index)
+
+    method.__name__ = name
+    method.__doc__ = api.__doc__
+    return method
+
+
+class chateda:
+    """openroad_api.chateda recording its calls to the process' trace instead of printing."""
+
+    def __init__(self) -> None:
+        self._flow = _trace.new_flow()
+        self._done = -1
+
+    setup = _traced("setup")
+    run_synthesis = _traced("run_synthesis")
+    floorplan = _traced("floorplan")
+    placement = _traced("placement")
+    cts = _traced("cts")
+    global_route = _traced("global_route")
+    detail_route = _traced("detail_route")
+    density_fill = _traced("density_fill")
+    final_report = _traced("final_report")
+
+    def get_metric(self, stage: str, metrics: list):
+        _trace.call(
+            self._flow,
+            "get_metric",
+            {"stage": _json_value(stage), "metrics": _json_value(metrics)},
+        )
+        if isinstance(metrics, str):
+            metrics = [metrics]
+        if stage not in METRIC_STAGES:
+            _trace.error(f"get_metric of unknown stage {stage!r}")
+        elif FLOW.index(METRIC_STAGES[stage]) > self._done:
+            _trace.error(f"get_metric of {stage} before {METRIC_STAGES[stage]}")
+        for metric in metrics:
+            if metric not in METRICS:
+                _trace.error(f"get_metric of unknown metric {metric!r}")
+            _trace.metrics.setdefault(str(stage), set()).add(str(metric))
+        return 0.0
+
+
+def _tune_values(name, para):
+    if not isinstance(para, dict) or "minmax" not in para:
+        raise ValueError(f'{name}: expected {{"minmax": [min, max], "step": step}}')
+    lo, hi = para["minmax"]
+    return [lo, hi] if lo != hi else [lo]
+
+
+def tune(func, param):
+    """openroad_api.tune calling func at the bounds of every parameter.
+    func runs once with every parameter at its minimum and once at its
+    maximum, so the trace shows which flow arguments the tuning varies.
+    """
+
+    _trace.call(-1, "tune", {"param": _json_value(param)})
+    _trace.tune_calls += 1
+    values = {name: _tune_values(name, para) for name, para in param.items()}
+    for i in range(max([len(v) for v in values.values()] + [1])):
+        func(**{name: v[min(i, len(v) - 1)] for name, v in values.items()})
+
+
+def install() -> None:
+    """Start a new trace and make `import chateda`, `from chateda import chateda, tune`
+    and `from openroad_api import ...` in scripts resolve to this stub.
+    """
+
+    global _trace
+    _trace = Trace()
+    module = _CallableModule("chateda")
+    module.chateda = chateda
+    module.tune = tune
+    for name in ("chateda", "openroad_api", "api_doc.openroad_api"):
+        sys.modules[name] = module
+
+
+def trace() -> Trace:
+    return _trace
+
+
+class _CallableModule(types.ModuleType):
+    # `import chateda` then `chateda()`, as generated scripts often do
+    def __call__(self, *args, **kwargs):
+        return chateda(*args, **kwargs)
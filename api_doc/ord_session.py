@@ -0,0 +1,171 @@
+import os
+import subprocess
+
+DONE_MARK = "@@chateda_done"
+# run() statuses besides the script's own: the interpreter died, or the script
+# asked for a design other than the one it holds and needs a fresh interpreter
+DIED = -1
+STALE = -2
+
+# Installed once per interpreter. The library readers skip files this process
+# already read, and read_db skips the design it already holds (when the file is
+# in ::chateda::same, which the session keeps up to date). Reading or linking
+# any other design while one is loaded fails with chateda-stale-design.
+PRELUDE = [
+    "namespace eval chateda { variable read {}; variable same {}; "
+    'variable block_file "" }',
+    "foreach cmd {read_lef read_liberty} { rename $cmd ::chateda_$cmd; "
+    "proc $cmd {args} [string map [list @CMD@ $cmd] { "
+    "set key [list @CMD@ {*}$args]; "
+    "if {[lsearch -exact $::chateda::read $key] >= 0} { return }; "
+    "::chateda_@CMD@ {*}$args; lappend ::chateda::read $key }] }",
+    "rename read_db ::chateda_read_db",
+    "proc read_db {args} { set file [file normalize [lindex $args end]]; "
+    'if {[ord::get_db_block] ne "NULL"} { '
+    "if {[lsearch -exact $::chateda::same $file] >= 0} { return }; "
+    "error chateda-stale-design }; "
+    "::chateda_read_db {*}$args; set ::chateda::block_file $file }",
+    "rename link_design ::chateda_link_design",
+    "proc link_design {args} { "
+    'if {[ord::get_db_block] ne "NULL"} { error chateda-stale-design }; '
+    "::chateda_link_design {*}$args }",
+    "rename write_db ::chateda_write_db",
+    "proc write_db {args} { ::chateda_write_db {*}$args; "
+    "set ::chateda::block_file [file normalize [lindex $args end]] }",
+]
+
+
+def tcl_quote(value: str) -> str:
+    """Quote a string as a Tcl word without substitutions."""
+    for c in '\\"$[]':
+        value = value.replace(c, "\\" + c)
+    return '"' + value + '"'
+
+
+def _stat(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class OrdSession:
+    """A long-lived OpenROAD interpreter that sources stage scripts one after another.
+
+    The environment of every script is synced into ::env before it is sourced,
+    and its metrics are written with utl::open_metrics/utl::close_metrics, the
+    same as `openroad -metrics` does for a fresh process. LEF and Liberty files
+    are read once per interpreter, and a script loading the odb the previous
+    script wrote (or a published link to it, see alias()) keeps the design in
+    memory instead of reading it again. The interpreter runs in its own process
+    group, so it can be killed with the tools it started.
+    """
+
+    def __init__(self, ord_cmd: str = "openroad -no_init") -> None:
+        self.ord_cmd = ord_cmd
+        self.proc = None
+        self.env = {}
+        # odb files whose content is the design in memory, with their stat then
+        self._same = {}
+
+    def process(self, env) -> subprocess.Popen:
+        """The interpreter, started with env if it isn't running."""
+        if self.proc is None or self.proc.poll() is not None:
+            self.proc = subprocess.Popen(
+                self.ord_cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                shell=True,
+                env=env,
+                text=True,
+                bufsize=1,
+                start_new_session=True,
+            )
+            self.env = dict(env)
+            self._same = {}
+            try:
+                for line in PRELUDE:
+                    self._send(line)
+            except OSError:
+                pass  # it died on start; run() reports DIED
+        return self.proc
+
+    def _send(self, line: str) -> None:
+        self.proc.stdin.write(line + "\n")
+
+    def _sync_env(self, env) -> None:
+        for k in self.env.keys() - env.keys():
+            self._send(f"unset -nocomplain ::env({k})")
+        for k, v in env.items():
+            if self.env.get(k) != v:
+                self._send(f"set ::env({k}) {tcl_quote(v)}")
+        self.env = dict(env)
+
+    def _same_files(self) -> list:
+        """The odb files still holding the design in memory."""
+        return [p for p, st in self._same.items() if _stat(p) == st]
+
+    def alias(self, src: str, dst: str) -> None:
+        """dst was published from src; it holds the design in memory if src does."""
+        if os.path.abspath(src) in self._same_files():
+            dst = os.path.abspath(dst)
+            self._same[dst] = _stat(dst)
+
+    def run(self, script: str, metrics: str, env, output) -> int:
+        """Source script with env and return its status, or DIED or STALE.
+        Every output line is passed to output(line). After any status but 0
+        the session is closed; the next run starts a fresh interpreter.
+        """
+
+        try:
+            if self.proc is None:
+                self.process(env)
+            self._sync_env(env)
+            same = " ".join(tcl_quote(p) for p in self._same_files())
+            self._send(f"set ::chateda::same [list {same}]")
+            self._send(f"utl::open_metrics {tcl_quote(metrics)}")
+            source = f"source {tcl_quote(script)}"
+            self._send(f"set chateda_rc [catch {{{source}}} chateda_msg]")
+            self._send("if {$chateda_rc} {puts $chateda_msg}")
+            self._send(f"utl::close_metrics {tcl_quote(metrics)}")
+            self._send(
+                f'puts "{DONE_MARK} $chateda_rc '
+                '[expr {$chateda_msg eq "chateda-stale-design"}] '
+                '$::chateda::block_file"; flush stdout'
+            )
+            self.proc.stdin.flush()
+        except OSError:
+            self.close()
+            return DIED
+
+        for line in self.proc.stdout:
+            if not line.startswith(DONE_MARK):
+                output(line)
+                continue
+            _, rc, stale, block_file = (line.rstrip("\n").split(" ", 3) + [""])[:4]
+            if rc != "0":
+                self.close()
+                return STALE if stale == "1" else int(rc)
+            self._same = {}
+            if block_file:
+                self._same[block_file] = _stat(block_file)
+            return 0
+        self.close()
+        return DIED
+
+    def close(self) -> None:
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            try:
+                self.proc.stdin.write("exit\n")
+                self.proc.stdin.close()
+                self.proc.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+                self.proc.wait()
+        self.proc = None
+        self.env = {}
+        self._same = {}
@@ -1,10 +1,385 @@
+import glob
 import os
+import re
 import subprocess
 import tempfile
 
-def parse(path):
-    '''Parse env variables defined in a Makefile fragment'''
-    env_before = os.environ
+# Results of parse(), per absolute path: list of (deps, names, cwd, result).
+# An entry is reused while the mtimes of deps (the fragment, its includes and
+# wildcard directories) and the values of the env vars in names are unchanged.
+_cache = {}
+_CACHE_ENTRIES_PER_PATH = 8
+
+_VAR_REF = re.compile(r'\$[({]([A-Za-z_][A-Za-z0-9_]*)[)}]')
+_ASSIGN = re.compile(r'^(?:export\s+)?([A-Za-z_][A-Za-z0-9_.]*)\s*(::=|:=|\?=|\+=|!=|=)\s*(.*)$')
+_INCLUDE = re.compile(r'^(-?include|sinclude)\s+(.*)$')
+_HASH = re.compile(r'(\\*)#')
+_MAX_DEPTH = 64
+# Variables make sets itself; their values depend on the make run
+_MAKE_VARS = {
+    'CURDIR', 'GPATH', 'MAKE', 'MAKECMDGOALS', 'MAKEFILES', 'MAKEFILE_LIST', 'MAKEFLAGS',
+    'MAKELEVEL', 'MAKE_COMMAND', 'MAKE_HOST', 'MAKE_RESTARTS', 'MAKE_TERMERR',
+    'MAKE_TERMOUT', 'MAKE_VERSION', 'MFLAGS', 'SHELL', 'SUFFIXES', 'VPATH',
+}
+# Variables of make's built-in implicit rules, unless the env or the fragment sets them
+_DEFAULT_VARS = {
+    'AR', 'ARFLAGS', 'AS', 'CC', 'CO', 'COFLAGS', 'CPP', 'CTANGLE', 'CWEAVE', 'CXX', 'F77',
+    'F77FLAGS', 'FC', 'GET', 'LD', 'LEX', 'LINT', 'M2C', 'MAKEINFO', 'OBJC',
+    'OUTPUT_OPTION', 'PC', 'RM', 'TANGLE', 'TEX', 'TEXI2DVI', 'WEAVE', 'YACC',
+}
+_AUTOMATIC = re.compile(r'[@%<?^+*|][DF]?$')
+
+
+class Unsupported(Exception):
+    '''Raised for Makefile constructs the native evaluator does not handle'''
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _uncomment(line):
+    '''line without its comment; as in make, `\\#` is a literal `#` and the
+    backslashes before a `#` are halved'''
+    out, start = [], 0
+    for m in _HASH.finditer(line):
+        slashes = len(m.group(1))
+        out.append(line[start:m.start()] + '\\' * (slashes // 2))
+        if slashes % 2 == 0:
+            return ''.join(out)
+        out.append('#')
+        start = m.end()
+    out.append(line[start:])
+    return ''.join(out)
+
+
+def _split_args(text):
+    '''Split function arguments on top-level commas'''
+    args, depth, start = [], 0, 0
+    for i, c in enumerate(text):
+        if c in '({':
+            depth += 1
+        elif c in ')}':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            args.append(text[start:i])
+            start = i + 1
+    args.append(text[start:])
+    return args
+
+
+def _dir(word):
+    return word[:word.rindex('/') + 1] if '/' in word else './'
+
+
+def _abspath(word):
+    '''make's abspath: relative to the working directory, `.`, `..` and repeated
+    slashes resolved without looking at the file system'''
+    parts = []
+    for part in (word if word.startswith('/') else os.getcwd() + '/' + word).split('/'):
+        if part == '..':
+            parts = parts[:-1]
+        elif part not in ('', '.'):
+            parts.append(part)
+    return '/' + '/'.join(parts)
+
+
+def _patsubst(pattern, replacement, word):
+    if '%' not in pattern:
+        return replacement if word == pattern else word
+    prefix, suffix = pattern.split('%', 1)
+    if word.startswith(prefix) and word.endswith(suffix) and len(word) >= len(prefix) + len(suffix):
+        stem = word[len(prefix):len(word) - len(suffix)]
+        return replacement.replace('%', stem, 1) if '%' in replacement else replacement
+    return word
+
+
+class _Evaluator:
+    '''Evaluates the `export VAR = value` / `?=` / `:=` / `+=` / `$(VAR)` subset of make'''
+
+    def __init__(self, env):
+        # name -> [value, recursive, exported]; like make, env vars are
+        # recursively expanded and exported
+        self.vars = {k: [v, True, True] for k, v in env.items()}
+        self.deps = {}
+        self.names = set()
+
+    def builtin(self, name):
+        '''Raise Unsupported if make itself gives name its value'''
+        if (name in _MAKE_VARS or name.startswith('.') or _AUTOMATIC.match(name)
+                or ('.' in name or name in _DEFAULT_VARS) and name not in self.vars):
+            raise Unsupported(f'make variable {name}')
+
+    def lookup(self, name, depth):
+        self.builtin(name)
+        self.names.add(name)
+        var = self.vars.get(name)
+        if var is None:
+            return ''
+        value, recursive, _ = var
+        return self.expand(value, depth + 1) if recursive else value
+
+    def expand(self, text, depth=0):
+        if depth > _MAX_DEPTH:
+            raise Unsupported('recursive variable loop')
+        out, i = [], 0
+        while i < len(text):
+            c = text[i]
+            if c != '$':
+                out.append(c)
+                i += 1
+                continue
+            if i + 1 >= len(text):
+                break
+            n = text[i + 1]
+            if n == '$':
+                out.append('$')
+                i += 2
+            elif n in '({':
+                close = ')' if n == '(' else '}'
+                level, j = 1, i + 2
+                while j < len(text) and level:
+                    if text[j] == n:
+                        level += 1
+                    elif text[j] == close:
+                        level -= 1
+                    j += 1
+                if level:
+                    raise Unsupported('unterminated reference')
+                out.append(self.reference(text[i + 2:j - 1], depth))
+                i = j
+            else:
+                out.append(self.lookup(n, depth))
+                i += 2
+        return ''.join(out)
+
+    def reference(self, body, depth):
+        m = re.match(r'([a-z]+)[ \t]+(.*)$', body, re.S)
+        if m is None:
+            if ':' in body or '$' in body:
+                raise Unsupported('computed or substitution reference')
+            return self.lookup(body.strip(), depth)
+        func = m.group(1)
+        args = [self.expand(a, depth + 1) for a in _split_args(m.group(2))]
+        words = lambda s: s.split()
+        if func == 'wildcard':
+            found = []
+            for pattern in words(args[0]):
+                self.deps[os.path.dirname(pattern) or '.'] = None
+                found += sorted(glob.glob(pattern))
+            return ' '.join(found)
+        if func == 'sort':
+            return ' '.join(sorted(set(words(args[0]))))
+        if func == 'strip':
+            return ' '.join(words(args[0]))
+        if func == 'dir':
+            return ' '.join(_dir(w) for w in words(args[0]))
+        if func == 'notdir':
+            return ' '.join(os.path.basename(w) for w in words(args[0]))
+        if func == 'abspath':
+            return ' '.join(_abspath(w) for w in words(args[0]))
+        if func == 'realpath':
+            return ' '.join(os.path.realpath(w) for w in words(args[0]) if os.path.exists(w))
+        if func == 'subst' and len(args) == 3:
+            return args[2].replace(args[0], args[1])
+        if func == 'patsubst' and len(args) == 3:
+            return ' '.join(_patsubst(args[0], args[1], w) for w in words(args[2]))
+        if func == 'addprefix' and len(args) == 2:
+            return ' '.join(args[0] + w for w in words(args[1]))
+        if func == 'addsuffix' and len(args) == 2:
+            return ' '.join(w + args[0] for w in words(args[1]))
+        if func == 'firstword':
+            return (words(args[0]) or [''])[0]
+        if func == 'lastword':
+            return (words(args[0]) or [''])[-1]
+        if func in ('info', 'warning'):
+            return ''
+        raise Unsupported(f'function {func}')
+
+    def condition(self, directive, rest):
+        if directive in ('ifdef', 'ifndef'):
+            name = self.expand(rest).strip()
+            self.builtin(name)
+            self.names.add(name)
+            var = self.vars.get(name)
+            defined = var is not None and var[0] != ''
+            return defined if directive == 'ifdef' else not defined
+        rest = rest.strip()
+        if rest.startswith('(') and rest.endswith(')'):
+            args = _split_args(rest[1:-1])
+            if len(args) != 2:
+                raise Unsupported('ifeq arguments')
+            # make strips only the blanks around the comma
+            a, b = args[0].rstrip(' \t'), args[1].lstrip(' \t')
+        else:
+            m = re.match(r'''(["'])(.*?)\1\s+(["'])(.*?)\3$''', rest)
+            if m is None:
+                raise Unsupported('ifeq arguments')
+            a, b = m.group(2), m.group(4)
+        equal = self.expand(a) == self.expand(b)
+        return equal if directive == 'ifeq' else not equal
+
+    def assign(self, name, op, value, export):
+        var = self.vars.get(name)
+        exported = export or (var is not None and var[2])
+        if op == '?=':
+            if var is None:
+                self.vars[name] = [value, True, exported]
+            elif export:
+                var[2] = True
+        elif op == '=':
+            self.vars[name] = [value, True, exported]
+        elif op in (':=', '::='):
+            self.vars[name] = [self.expand(value), False, exported]
+        elif op == '+=':
+            if var is None:
+                self.vars[name] = [value, True, exported]
+            else:
+                if not var[1]:
+                    value = self.expand(value)
+                var[0] = (var[0] + ' ' + value) if var[0] else value
+                var[2] = exported
+        else:
+            raise Unsupported(f'{op} assignment')
+
+    def include(self, path):
+        path = os.path.normpath(path)
+        self.deps[path] = None
+        with open(path) as f:
+            text = f.read()
+        # join continuation lines
+        text = re.sub(r'[ \t]*\\\n\s*', ' ', text)
+
+        active = []  # stack of [taking, any branch taken]
+        for raw in text.split('\n'):
+            if raw.startswith('\t'):
+                raise Unsupported('recipe line')
+            # make keeps the whitespace a value ends with
+            line = _uncomment(raw).lstrip()
+            if not line.strip():
+                continue
+            word, rest = (re.split(r'\s+', line, 1) + [''])[:2]
+            taking = all(a[0] for a in active)
+            if word in ('ifdef', 'ifndef', 'ifeq', 'ifneq'):
+                result = taking and self.condition(word, rest)
+                active.append([result, result])
+                continue
+            if word == 'else':
+                if rest.strip():
+                    raise Unsupported('else if')
+                if not active:
+                    raise Unsupported('else without if')
+                active[-1][0] = not active[-1][1]
+                continue
+            if word == 'endif':
+                if not active:
+                    raise Unsupported('endif without if')
+                active.pop()
+                continue
+            if not taking:
+                continue
+
+            m = _INCLUDE.match(line)
+            if m:
+                for inc in self.expand(m.group(2)).split():
+                    if m.group(1) == 'include' or os.path.exists(inc):
+                        self.include(inc)
+                continue
+            m = _ASSIGN.match(line)
+            if m:
+                name, op, value = m.groups()
+                self.names.add(name)
+                self.assign(name, op, value, line.startswith('export'))
+                continue
+            if word == 'export' and rest.strip():
+                for name in self.expand(rest).split():
+                    self.names.add(name)
+                    var = self.vars.setdefault(name, ['', False, True])
+                    var[2] = True
+                continue
+            raise Unsupported(line)
+        if active:
+            raise Unsupported('missing endif')
+
+    def exported(self, env_before):
+        return {
+            name: self.lookup(name, 0)
+            for name, (_, _, exported) in self.vars.items()
+            if exported and name not in env_before
+        }
+
+
+def _scan(path, env):
+    '''Files and variable names a fragment depends on, found textually'''
+    deps, names, todo = {}, set(), [path]
+    while todo:
+        p = os.path.normpath(todo.pop())
+        if p in deps:
+            continue
+        deps[p] = None
+        try:
+            with open(p) as f:
+                text = f.read()
+        except OSError:
+            continue
+        names.update(_VAR_REF.findall(text))
+        for line in text.split('\n'):
+            m = _ASSIGN.match(line.strip())
+            if m:
+                names.add(m.group(1))
+            m = _INCLUDE.match(line.strip())
+            if m:
+                inc = _VAR_REF.sub(lambda r: env.get(r.group(1), ''), m.group(2))
+                todo += inc.split()
+    return deps, names
+
+
+def parse(path, env=None):
+    '''Parse env variables defined in a Makefile fragment
+
+    env is the environment make is evaluated in (os.environ by default).
+    Variables already defined in it are not returned.
+    Results are memoized on the path, the mtimes of the fragment and its
+    includes, and the values of the env variables the fragment refers to.
+    The common `export VAR = value` subset is evaluated natively; everything
+    else falls back to running make.
+    '''
+    if env is None:
+        env = os.environ
+    key = os.path.abspath(path)
+    cwd = os.getcwd()
+    for deps, names, entry_cwd, result in _cache.get(key, []):
+        if (entry_cwd == cwd
+                and all(_mtime(f) == m for f, m in deps.items())
+                and all(env.get(n) == v for n, v in names.items())):
+            return dict(result)
+
+    try:
+        evaluator = _Evaluator(env)
+        evaluator.include(path)
+        result = evaluator.exported(env)
+        deps, names = evaluator.deps, evaluator.names
+    except (Unsupported, OSError, IndexError):
+        result = _parse_make(path, env)
+        deps, names = _scan(path, env)
+
+    entries = _cache.setdefault(key, [])
+    entries.insert(0, (
+        {f: _mtime(f) for f in deps},
+        {n: env.get(n) for n in names},
+        cwd,
+        result,
+    ))
+    del entries[_CACHE_ENTRIES_PER_PATH:]
+    return dict(result)
+
+
+def _parse_make(path, env):
+    '''Parse a Makefile fragment by running make on it'''
+    env_before = env
 
     with tempfile.TemporaryDirectory() as tempdir:
         makefile_path = os.path.join(tempdir, 'Makefile')
@@ -13,7 +388,7 @@ def parse(path):
             print(f'all:', file=f)
             print(f'\tprintenv', file=f)
 
-        proc = subprocess.run(['make', '-s', '--no-print-directory', '-f', makefile_path], stdout=subprocess.PIPE)
+        proc = subprocess.run(['make', '-s', '--no-print-directory', '-f', makefile_path], stdout=subprocess.PIPE, env=env)
         output = proc.stdout.decode('utf-8')
 
     new_envvars = {}
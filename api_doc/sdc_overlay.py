@@ -0,0 +1,49 @@
+import os
+import re
+
+# File name of the generated SDC in RESULTS_DIR. It matches no stage output
+# pattern, so restoring a stage from the cache never removes it.
+OVERLAY_FILE = "0_constraint.sdc"
+
+
+def render(text: str, variables) -> str:
+    """SDC text with the Tcl variables set to new values.
+    A `set name value` line of the SDC is replaced; variables it doesn't set
+    are set at its top.
+    """
+
+    lines = text.splitlines(keepends=True)
+    missing = []
+    for name, value in variables.items():
+        pattern = re.compile(rf"^(\s*)set\s+{re.escape(name)}\s")
+        found = False
+        for i, line in enumerate(lines):
+            m = pattern.match(line)
+            if m:
+                lines[i] = f"{m.group(1)}set {name} {value}\n"
+                found = True
+        if not found:
+            missing.append(f"set {name} {value}\n")
+    return "".join(missing + lines)
+
+
+def write(src: str, results_dir: str, variables) -> str:
+    """Write src with variables overridden to RESULTS_DIR and return its path.
+    The file is only rewritten when its content changes, so its digest stays
+    memoized and stage keys over it stay stable.
+    """
+
+    with open(src) as f:
+        text = render(f.read(), variables)
+    dst = os.path.join(results_dir, OVERLAY_FILE)
+    try:
+        with open(dst) as f:
+            if f.read() == text:
+                return dst
+    except FileNotFoundError:
+        pass
+    tmp = f"{dst}.tmp-{os.getpid()}"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, dst)
+    return dst
@@ -0,0 +1,264 @@
+import fcntl
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import artifacts
+
+# Artifacts, knobs and outputs of every flow stage.
+#   inputs  -- env vars holding (space separated) paths of input files
+#   results -- input files read from RESULTS_DIR
+#   knobs   -- env vars that change what the stage produces
+#   outputs -- file name patterns written to RESULTS_DIR, LOG_DIR and REPORTS_DIR
+COMMON_KNOBS = ["DESIGN_NAME", "PLATFORM", "PLATFORM_DIR", "ADDITIONAL_LEFS"]
+
+STAGES = {
+    "synth": {
+        "inputs": ["VERILOG_FILES", "SDC_FILE", "DONT_USE_LIBS"],
+        "results": [],
+        "knobs": [
+            "ABC_AREA",
+            "ABC_CLOCK_PERIOD_IN_PS",
+            "SYNTH_HIERARCHICAL",
+            "SYNTH_PARALLEL",
+            "SYNTH_BLACKBOXES",
+            "SYNTH_ARGS",
+            "MAX_UNGROUP_SIZE",
+            "RESYNTH_AREA_RECOVER",
+            "RESYNTH_TIMING_RECOVER",
+            "DONT_USE_CELLS",
+            "VERILOG_INCLUDE_DIRS",
+        ],
+        "outputs": ["1_*"],
+    },
+    "floorplan": {
+        "inputs": ["MACRO_PLACEMENT", "FLOORPLAN_DEF", "PDN_TCL"],
+        "results": ["1_synth.v", "1_synth.sdc"],
+        "knobs": [
+            "CORE_UTILIZATION",
+            "CORE_ASPECT_RATIO",
+            "CORE_MARGINS",
+            "DIE_AREA",
+            "CORE_AREA",
+            "MACRO_PLACE_HALO",
+            "MACRO_PLACE_CHANNEL",
+            "RTLMP_FLOW",
+            "PLACE_PINS_ARGS",
+            "PLACE_DENSITY",
+        ],
+        "outputs": ["2_*"],
+    },
+    "place": {
+        "inputs": [],
+        "results": ["2_floorplan.odb", "2_floorplan.sdc"],
+        "knobs": [
+            "PLACE_DENSITY",
+            "PLACE_DENSITY_LB_ADDON",
+            "GPL_TIMING_DRIVEN",
+            "GPL_ROUTABILITY_DRIVEN",
+            "ENABLE_DPO",
+            "DPO_MAX_DISPLACEMENT",
+            "CELL_PAD_IN_SITES_GLOBAL_PLACEMENT",
+            "CELL_PAD_IN_SITES_DETAIL_PLACEMENT",
+            "PLACE_PINS_ARGS",
+        ],
+        "outputs": ["3_*"],
+    },
+    "cts": {
+        "inputs": [],
+        "results": ["3_place.odb", "3_place.sdc"],
+        "knobs": [
+            "TNS_END_PERCENT",
+            "CTS_CLUSTER_SIZE",
+            "CTS_CLUSTER_DIAMETER",
+            "CTS_BUF_CELL",
+        ],
+        "outputs": ["4_*"],
+    },
+    "global_route": {
+        "inputs": [],
+        "results": ["4_cts.odb", "4_cts.sdc"],
+        "knobs": [
+            "MIN_ROUTING_LAYER",
+            "MAX_ROUTING_LAYER",
+            "ROUTING_LAYER_ADJUSTMENT",
+            "GLOBAL_ROUTE_ARGS",
+        ],
+        "outputs": ["5_1_*", "route.guide"],
+    },
+    "detail_route": {
+        "inputs": [],
+        "results": ["4_cts.odb", "4_cts.sdc", "5_1_grt.odb", "route.guide"],
+        "knobs": [
+            "MIN_ROUTING_LAYER",
+            "MAX_ROUTING_LAYER",
+            "DETAILED_ROUTE_ARGS",
+        ],
+        "outputs": ["5_2_*", "5_route.*"],
+    },
+    "density_fill": {
+        "inputs": ["DENSITY_FILL"],
+        "results": ["5_route.odb"],
+        "knobs": [],
+        "outputs": ["6_1_fill.odb", "6_density_fill.*"],
+    },
+    "final_report": {
+        "inputs": [],
+        "results": ["6_1_fill.odb", "5_route.sdc"],
+        "knobs": [],
+        "outputs": ["6_report*", "6_final*", "6_1_fill.sdc"],
+    },
+}
+
+OUTPUT_DIRS = ["RESULTS_DIR", "LOG_DIR", "REPORTS_DIR"]
+
+DEFAULT_MAX_BYTES = 20 * 1024**3
+
+_digests = {}
+
+
+def file_digest(path):
+    """sha256 of a file's content, memoized on (path, size, mtime)."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    digest = _digests.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _digests[memo_key] = digest
+    return digest
+
+
+def _scripts_digest(scripts_dir):
+    h = hashlib.sha256()
+    if os.path.isdir(scripts_dir):
+        for name in sorted(os.listdir(scripts_dir)):
+            if name.endswith(".tcl"):
+                h.update(name.encode())
+                h.update(file_digest(os.path.join(scripts_dir, name)).encode())
+    return h.hexdigest()
+
+
+def stage_key(stage, env):
+    """Key of a stage run: digest of its input artifacts, scripts and knobs."""
+    spec = STAGES[stage]
+    h = hashlib.sha256()
+    h.update(stage.encode())
+    h.update(_scripts_digest(env.get("SCRIPTS_DIR", "")).encode())
+    for name in COMMON_KNOBS + spec["knobs"]:
+        h.update(f"\0{name}={env.get(name, '')}".encode())
+    paths = []
+    for name in spec["inputs"]:
+        paths += env.get(name, "").split()
+    paths += [os.path.join(env["RESULTS_DIR"], f) for f in spec["results"]]
+    for path in paths:
+        h.update(b"\0" + os.path.basename(path).encode() + b"=")
+        h.update(file_digest(path).encode() if os.path.isfile(path) else b"missing")
+    return h.hexdigest()
+
+
+def stage_outputs(stage, env):
+    """Yield (dir var, file name) of the outputs a stage has written."""
+    patterns = STAGES[stage]["outputs"]
+    for dir_var in OUTPUT_DIRS:
+        out_dir = env.get(dir_var, "")
+        if not os.path.isdir(out_dir):
+            continue
+        for name in sorted(os.listdir(out_dir)):
+            path = os.path.join(out_dir, name)
+            if os.path.isfile(path) and any(fnmatch.fnmatch(name, p) for p in patterns):
+                yield dir_var, name
+
+
+class StageCache:
+    """Size-bounded LRU cache of stage outputs, addressed by stage_key()."""
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def lock(self, key: str):
+        """Block until no other flow is computing key; hold the lock until unlock()."""
+        lock_dir = os.path.join(self.root, ".locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        f = open(os.path.join(lock_dir, key), "w")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def unlock(self, lock) -> None:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    def restore(self, key: str, env) -> bool:
+        """Publish a cached stage result into the flow directories of env."""
+        entry = os.path.join(self.root, key)
+        meta_path = os.path.join(entry, "meta.json")
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        published = []
+        try:
+            for dir_var, name in meta["files"]:
+                os.makedirs(env[dir_var], exist_ok=True)
+                dst = os.path.join(env[dir_var], name)
+                artifacts.publish(os.path.join(entry, dir_var, name), dst)
+                published.append(dst)
+            # the mtime of meta.json is the LRU clock
+            os.utime(meta_path)
+        except OSError:
+            # another flow evicted the entry while it was being restored
+            artifacts.unlink_outputs(published)
+            return False
+        return True
+
+    def store(self, key: str, stage: str, env) -> None:
+        """Save the outputs a stage wrote into the flow directories of env."""
+        entry = os.path.join(self.root, key)
+        if os.path.isdir(entry):
+            return
+        tmp = tempfile.mkdtemp(dir=self.root, prefix=".tmp-")
+        files, size = [], 0
+        for dir_var, name in stage_outputs(stage, env):
+            os.makedirs(os.path.join(tmp, dir_var), exist_ok=True)
+            dst = os.path.join(tmp, dir_var, name)
+            artifacts.publish(os.path.join(env[dir_var], name), dst)
+            files.append([dir_var, name])
+            size += os.path.getsize(dst)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({"stage": stage, "files": files, "size": size}, f)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # another flow stored the same result first
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        entries, total = [], 0
+        for key in os.listdir(self.root):
+            if key.startswith("."):
+                continue
+            meta_path = os.path.join(self.root, key, "meta.json")
+            try:
+                with open(meta_path) as f:
+                    size = json.load(f)["size"]
+                atime = os.path.getmtime(meta_path)
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((atime, size, key))
+            total += size
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            total -= size
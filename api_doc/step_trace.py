@@ -0,0 +1,76 @@
+import json
+import re
+
+# Output of the /usr/bin/time format string chateda.time_cmd uses
+TIME_LINE = re.compile(
+    r"Elapsed time: (?P<elapsed>[\d:.]+)\[h:\]min:sec\. "
+    r"CPU time: user (?P<user>[\d.]+) sys (?P<sys>[\d.]+) \((?P<cpu>[\d?]+)%\)\. "
+    r"Peak memory: (?P<rss>\d+)KB\."
+)
+
+
+def parse_time_line(line: str):
+    """Fields of a /usr/bin/time line as a dict, or None if line isn't one."""
+    m = TIME_LINE.search(line)
+    if m is None:
+        return None
+    wall = 0.0
+    for part in m.group("elapsed").split(":"):
+        wall = wall * 60 + float(part)
+    return {
+        "wall_s": wall,
+        "user_s": float(m.group("user")),
+        "sys_s": float(m.group("sys")),
+        "cpu_percent": None if m.group("cpu") == "?" else int(m.group("cpu")),
+        "peak_rss_kb": int(m.group("rss")),
+    }
+
+
+def write_json(records, path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(records, f, indent=2)
+
+
+def write_chrome_trace(records, path: str) -> None:
+    """Write step records as a Chrome trace (chrome://tracing, Perfetto).
+    Every flow gets its own track; a step is a complete event over its wall time.
+    """
+
+    flows = {}
+    events = []
+    for r in records:
+        tid = flows.setdefault(r["flow"], len(flows) + 1)
+        events.append(
+            {
+                "name": r["step"],
+                "cat": r["stage"],
+                "ph": "X",
+                "ts": r["start"] * 1e6,
+                "dur": r["wall_s"] * 1e6,
+                "pid": 1,
+                "tid": tid,
+                "args": {
+                    k: r[k]
+                    for k in (
+                        "script",
+                        "user_s",
+                        "sys_s",
+                        "cpu_percent",
+                        "peak_rss_kb",
+                        "exit_code",
+                    )
+                },
+            }
+        )
+    for flow, tid in flows.items():
+        events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": 1,
+                "tid": tid,
+                "args": {"name": flow},
+            }
+        )
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
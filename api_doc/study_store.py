@@ -0,0 +1,62 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import optuna
+
+# SQLite file of all studies in a study directory
+STUDY_DB = "studies.db"
+# User attribute of the trials that ran the whole flow; trials stopped early
+# or at a stage limit don't have it and are never seeded
+FINAL_ATTR = "final"
+
+
+def study_name(study: str, param) -> str:
+    """Name of the stored study of a design/platform label and a param space.
+    Sweeps only share a study when their params, ranges and steps all match,
+    since Optuna can't mix trials of different distributions.
+    """
+
+    space = json.dumps(param, sort_keys=True, default=str)
+    return f"{study}-{hashlib.sha256(space.encode()).hexdigest()[:16]}"
+
+
+def storage(study_dir: str):
+    """Optuna storage of the studies in study_dir, created if needed."""
+    os.makedirs(study_dir, exist_ok=True)
+    url = "sqlite:///" + os.path.join(os.path.abspath(study_dir), STUDY_DB)
+    return optuna.storages.RDBStorage(
+        url, engine_kwargs={"connect_args": {"timeout": 60}}
+    )
+
+
+def best_points(storage, name: str, k: int) -> list:
+    """Params of up to k Pareto-optimal finished trials of a stored study, best
+    first by the sum of their ranks in every objective; [] for a new study.
+    Only trials marked with FINAL_ATTR count, so the stage results of trials
+    an earlier sweep stopped early never come back as seeds.
+    """
+
+    try:
+        study = optuna.load_study(study_name=name, storage=storage)
+    except KeyError:
+        return []
+    final = [
+        t
+        for t in study.trials
+        if t.state == optuna.trial.TrialState.COMPLETE and t.user_attrs.get(FINAL_ATTR)
+    ]
+    if not final or k <= 0:
+        return []
+    minimize = optuna.study.StudyDirection.MINIMIZE
+    signs = np.array([1 if d == minimize else -1 for d in study.directions])
+    values = np.array([t.values for t in final], dtype=float) * signs
+    ranks = values.argsort(0).argsort(0).sum(1)
+    # [i, j]: trial j is at least as good as trial i everywhere, better somewhere
+    dominated = (
+        (values[:, None] >= values[None]).all(2)
+        & (values[:, None] > values[None]).any(2)
+    ).any(1)
+    order = [i for i in np.argsort(ranks, kind="stable") if not dominated[i]]
+    return [dict(final[i].params) for i in order[:k]]
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+
+import dse_journal
+
+# Fewer observations than this and the model is not trusted to screen
+MIN_OBSERVATIONS = 5
+
+
+def load_history(paths, names, metrics):
+    """Observations of earlier sweeps: X (n, len(names)) of trial configs and
+    Y (n, len(metrics)) of their final results. paths are sweep directories
+    given to tuned(journal=...) or journal files; trials that didn't finish,
+    lack a param of names or a metric, or were stopped at a stage limit are skipped.
+    """
+
+    xs, ys = [], []
+    for path in paths:
+        if os.path.isdir(path):
+            path = os.path.join(path, dse_journal.JOURNAL_FILE)
+        for trial in dse_journal.Journal(path).trials().values():
+            config = trial["config"] or {}
+            result = dse_journal.final_result(trial)
+            if result is None or "limit" in result:
+                continue
+            if any(n not in config for n in names):
+                continue
+            if any(not isinstance(result.get(m), (int, float)) for m in metrics):
+                continue
+            xs.append([float(config[n]) for n in names])
+            ys.append([float(result[m]) for m in metrics])
+    return np.array(xs).reshape(-1, len(names)), np.array(ys).reshape(-1, len(metrics))
+
+
+class GaussianProcess:
+    """Gaussian process regressor with an RBF kernel, one output per column of Y.
+    Inputs are scaled to [0, 1] by bounds and outputs standardized, so the
+    length scale and noise level work without tuning.
+    """
+
+    def __init__(self, bounds, length_scale: float = 0.3, noise: float = 1e-2) -> None:
+        bounds = np.asarray(bounds, dtype=float)
+        self.low = bounds[:, 0]
+        span = bounds[:, 1] - bounds[:, 0]
+        self.span = np.where(span > 0, span, 1)
+        self.length_scale = length_scale
+        self.noise = noise
+
+    def _kernel(self, a, b):
+        d2 = (a * a).sum(1)[:, None] + (b * b).sum(1)[None, :] - 2 * a @ b.T
+        return np.exp(-np.maximum(d2, 0) / (2 * self.length_scale**2))
+
+    def fit(self, X, Y):
+        self.X = (np.asarray(X, dtype=float) - self.low) / self.span
+        Y = np.asarray(Y, dtype=float)
+        self.mean = Y.mean(0)
+        self.scale = np.where(Y.std(0) > 0, Y.std(0), 1)
+        K = self._kernel(self.X, self.X) + self.noise * np.eye(len(self.X))
+        self.L = np.linalg.cholesky(K)
+        self.alpha = np.linalg.solve(
+            self.L.T, np.linalg.solve(self.L, (Y - self.mean) / self.scale)
+        )
+        return self
+
+    def predict(self, X):
+        """Standardized predictive mean (n, outputs) and std (n,) at X."""
+        X = (np.asarray(X, dtype=float) - self.low) / self.span
+        Ks = self._kernel(X, self.X)
+        v = np.linalg.solve(self.L, Ks.T)
+        var = np.maximum(1 - (v * v).sum(0), 0)
+        return Ks @ self.alpha, np.sqrt(var)
+
+
+def screen(candidates, names, bounds, X, Y, keep: int, kappa: float = 1.0):
+    """The keep candidate configs with the best predicted results, best first.
+    Every column of Y is minimized; the score of a candidate is the sum of its
+    standardized predicted means less kappa times its predictive std, so
+    configs far from the history still get tried. Candidates are returned
+    unranked when the history is too small to fit on.
+    """
+
+    if len(X) < MIN_OBSERVATIONS or len(candidates) <= keep:
+        return list(candidates)[:keep]
+    model = GaussianProcess(bounds).fit(X, Y)
+    C = np.array([[float(c[n]) for n in names] for c in candidates])
+    mean, std = model.predict(C)
+    score = mean.sum(1) - kappa * std * np.sqrt(Y.shape[1])
+    return [candidates[i] for i in np.argsort(score, kind="stable")[:keep]]
@@ -0,0 +1,131 @@
+import re
+
+# Stop modules as synth_hier_report.tcl writes them to SYNTH_STOP_MODULE_SCRIPT:
+#   select -module {name}; setattr -mod -set keep_hierarchy 1; select -clear
+# or in one line: setattr -mod -set keep_hierarchy 1 name
+_STOP_MODULE = re.compile(
+    r"^\s*(?:select\s+-module|setattr\s+-mod\s+-set\s+keep_hierarchy\s+1)"
+    r"\s+\{?([^}\s;]+)\}?",
+    re.M,
+)
+_COMMENT = re.compile(r"//[^\n]*|/\*.*?\*/", re.S)
+_MODULE = re.compile(
+    r"^\s*(?:macro)?module\s+(\\?[\w$]+)(.*?)^\s*endmodule\b", re.M | re.S
+)
+# a whole module of a netlist, with the rest of its endmodule line
+_NETLIST_MODULE = re.compile(
+    r"^[ \t]*module\s+(\\?[\w$]+).*?^\s*endmodule\b[^\n]*\n?", re.M | re.S
+)
+_WORD = re.compile(r"[A-Za-z_][\w$]*")
+
+
+def stop_modules(script: str) -> list:
+    """Modules synth_hier_report.tcl marked to keep as hierarchy, in order."""
+    try:
+        with open(script) as f:
+            text = f.read()
+    except FileNotFoundError:
+        return []
+    modules = []
+    for name in _STOP_MODULE.findall(text):
+        if name not in modules:
+            modules.append(name)
+    return modules
+
+
+def _modules(path: str) -> dict:
+    """{module: set of words in its body} of a Verilog file."""
+    with open(path, errors="replace") as f:
+        text = _COMMENT.sub(" ", f.read())
+    return {
+        name.lstrip("\\"): set(_WORD.findall(body))
+        for name, body in _MODULE.findall(text)
+    }
+
+
+class Design:
+    """Module definitions of the VERILOG_FILES of a design and what each instantiates."""
+
+    def __init__(self, verilog_files) -> None:
+        self.files = list(verilog_files)
+        self.file_of = {}
+        words = {}
+        for path in self.files:
+            for name, body in _modules(path).items():
+                self.file_of.setdefault(name, path)
+                words.setdefault(name, set()).update(body)
+        # any word of a module body naming a module; over-approximates instances
+        self.children = {
+            name: {w for w in body if w in self.file_of and w != name}
+            for name, body in words.items()
+        }
+
+    def files_of(self, top: str, blackboxes) -> list:
+        """Files a partition needs: those defining top and every module below it,
+        down to the blackboxes, whose definitions give their ports.
+        """
+
+        seen, todo = set(), [top]
+        while todo:
+            name = todo.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            if name == top or name not in blackboxes:
+                todo += self.children.get(name, ())
+        needed = {self.file_of[m] for m in seen if m in self.file_of}
+        return [f for f in self.files if f in needed]
+
+
+def partitions(env) -> list:
+    """Partitions of a hierarchical synthesis: [(top, blackboxes, env)], the design
+    top first. Each partition synthesizes one of the stop modules, or the design
+    top, with the other stop modules as blackboxes; env is the flow's with
+    DESIGN_NAME, SYNTH_BLACKBOXES and VERILOG_FILES set for it. Empty if no stop
+    module was marked.
+    """
+
+    design = Design(env["VERILOG_FILES"].split())
+    top = env["DESIGN_NAME"]
+    stops = [
+        m
+        for m in stop_modules(env["SYNTH_STOP_MODULE_SCRIPT"])
+        if m != top and m in design.file_of
+    ]
+    if not stops:
+        return []
+    result = []
+    for module in [top] + stops:
+        blackboxes = [m for m in stops if m != module]
+        part_env = dict(env)
+        part_env.update(
+            DESIGN_NAME=module,
+            SYNTH_BLACKBOXES=" ".join(blackboxes),
+            SYNTH_HIERARCHICAL="0",
+            VERILOG_FILES=" ".join(design.files_of(module, blackboxes)),
+        )
+        result.append((module, blackboxes, part_env))
+    return result
+
+
+def stitch(netlists, out: str) -> None:
+    """Write the modules of the partition netlists into one netlist.
+    Modules defined by several partitions are written once.
+    """
+
+    seen = set()
+    with open(out, "w") as f:
+        for path in netlists:
+            with open(path) as n:
+                text = n.read()
+            blocks = list(_NETLIST_MODULE.finditer(text))
+            if not blocks:
+                f.write(text)
+                continue
+            for block in blocks:
+                if block.group(1) in seen:
+                    continue
+                seen.add(block.group(1))
+                f.write(block.group(0))
+                if not block.group(0).endswith("\n"):
+                    f.write("\n")
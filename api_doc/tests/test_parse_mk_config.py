@@ -0,0 +1,78 @@
+import os
+import shutil
+
+import pytest
+
+import parse_mk_config
+
+pytestmark = pytest.mark.skipif(shutil.which('make') is None, reason='needs GNU make')
+
+FRAGMENTS = {
+    'paths': '''
+export D1 = $(dir /foo)
+export D2 = $(dir a/b//c x)
+export N1 = $(notdir a/b/c d/)
+export A1 = $(abspath x)
+export A2 = $(abspath ../x//y/./z)
+export A3 = $(abspath //x /)
+export R1 = $(realpath . nonexistent)
+''',
+    'ifeq': '''
+X = foo 
+Y = foo
+ifeq ( foo,foo)
+export E1 = y
+endif
+ifeq (foo , foo)
+export E2 = y
+endif
+ifeq (foo,foo )
+export E3 = y
+endif
+ifeq ($(X),foo)
+export E4 = y
+endif
+ifneq ($(Y) ,  $(Y))
+export E5 = y
+endif
+ifeq "$(Y)" "foo"
+export E6 = y
+endif
+''',
+    'assign': '''
+export A ?= one
+A += two
+B := $(A)
+export C = $(B) three \\# not a comment # a comment
+export D = $(patsubst %.v,%.odb,a.v b.v) $(addprefix -I,x y)
+export E = $(sort b a b) $(firstword x y) $(lastword x y)
+''',
+    'builtin': '''
+export M1 = $(CURDIR)/x
+export M2 = $(lastword $(MAKEFILE_LIST))
+export M3 = [$@] $(CC)
+''',
+}
+
+
+def _native(path, env):
+    evaluator = parse_mk_config._Evaluator(env)
+    evaluator.include(path)
+    return evaluator.exported(env)
+
+
+@pytest.mark.parametrize('name', sorted(FRAGMENTS))
+def test_parse_matches_make(name, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = os.path.join(tmp_path, name + '.mk')
+    with open(path, 'w') as f:
+        f.write(FRAGMENTS[name])
+    env = {'PATH': os.environ.get('PATH', '')}
+    expected = parse_mk_config._parse_make(path, env)
+    if name == 'builtin':
+        with pytest.raises(parse_mk_config.Unsupported):
+            _native(path, env)
+    else:
+        assert _native(path, env) == expected
+    parse_mk_config._cache.clear()
+    assert parse_mk_config.parse(path, env) == expected
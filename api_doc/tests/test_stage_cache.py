@@ -0,0 +1,55 @@
+import hashlib
+import os
+
+import fake_eda
+import openroad_api_impl
+
+
+def _flow(root, cache_dir, variant):
+    ceda = openroad_api_impl.chateda(on_output=lambda line: None, cache_dir=cache_dir)
+    fake_eda.install(ceda)
+    ceda.env.update(FLOW_VARIANT=variant, FAKE_EDA_LATENCY="0", FAKE_EDA_LOG_LINES="1")
+    ceda.setup("gcd", "nangate45", flow_home=root)
+    return ceda
+
+
+def _entry_digests(cache_dir):
+    digests = {}
+    for key in os.listdir(cache_dir):
+        if key.startswith("."):
+            continue
+        for dir_path, _, names in os.walk(os.path.join(cache_dir, key)):
+            for name in names:
+                if name != "meta.json":
+                    path = os.path.join(dir_path, name)
+                    with open(path, "rb") as f:
+                        digests[path] = hashlib.sha256(f.read()).hexdigest()
+    return digests
+
+
+def test_rerun_of_restored_stage_keeps_cache_entry(tmp_path):
+    root = fake_eda.make_flow(str(tmp_path / "flow"))
+    cache_dir = str(tmp_path / "cache")
+    first = _flow(root, cache_dir, "first")
+    first.run_synthesis()
+    first.floorplan()
+    cached = _entry_digests(cache_dir)
+    assert any(path.endswith(".odb") for path in cached)
+
+    second = _flow(root, cache_dir, "second")
+    second.run_synthesis()
+    second.floorplan()
+    results_dir = second.env["RESULTS_DIR"]
+    assert os.stat(os.path.join(results_dir, "2_1_floorplan.odb")).st_nlink > 1
+
+    # other knobs: the restored outputs are rewritten
+    second.floorplan(core_utilization=20)
+    digests = _entry_digests(cache_dir)
+    assert {path: digests.get(path) for path in cached} == cached
+
+    # the whole flow again, over every restored output
+    second.floorplan()
+    assert second.get_metric("floorplan", ["area"]) is not None
+    cached = _entry_digests(cache_dir)
+    second.run_all()
+    assert _entry_digests(cache_dir) == cached
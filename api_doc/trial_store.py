@@ -0,0 +1,286 @@
+import fcntl
+import gzip
+import json
+import os
+import shutil
+import time
+
+import stage_cache
+
+try:
+    import zstandard
+except ImportError:
+    # blobs are gzip-compressed without the zstandard package
+    zstandard = None
+
+# Flow directories of a trial that are archived
+TRIAL_DIRS = ["RESULTS_DIR", "LOG_DIR", "REPORTS_DIR", "OBJECTS_DIR"]
+DEFAULT_MAX_BYTES = 50 * 1024**3
+# Objectives of the Pareto front of kept trials, as in tuned()'s search
+DEFAULT_OBJECTIVES = {"area": "min", "power": "min"}
+# Blob file extension of every codec
+CODEC_EXT = {"zstd": ".zst", "gzip": ".gz"}
+
+
+class CodecUnavailable(RuntimeError):
+    """A blob is compressed with a codec this Python can't decompress."""
+
+
+def _compress(src: str, dst: str, codec: str) -> None:
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        if codec == "zstd":
+            zstandard.ZstdCompressor(level=10, threads=-1).copy_stream(s, d)
+        else:
+            with gzip.GzipFile(fileobj=d, mode="wb", compresslevel=6) as z:
+                shutil.copyfileobj(s, z, 1 << 20)
+
+
+def _decompress(src: str, dst: str) -> None:
+    if src.endswith(".zst") and zstandard is None:
+        raise CodecUnavailable(
+            f"{src} is zstd-compressed but the zstandard package is not installed; "
+            "install it, or share trial stores created with codec='gzip'"
+        )
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        if src.endswith(".zst"):
+            zstandard.ZstdDecompressor().copy_stream(s, d)
+        else:
+            with gzip.GzipFile(fileobj=s, mode="rb") as z:
+                shutil.copyfileobj(z, d, 1 << 20)
+
+
+def pareto_front(results, objectives) -> set:
+    """Indices of the results no other result dominates in all objectives."""
+    import numpy as np
+
+    signs = [1 if mode == "min" else -1 for mode in objectives.values()]
+    values = np.array(
+        [[r[m] * s for m, s in zip(objectives, signs)] for r in results], dtype=float
+    ).reshape(len(results), len(objectives))
+    front = set()
+    for i, v in enumerate(values):
+        dominated = np.all(values <= v, axis=1) & np.any(values < v, axis=1)
+        if not dominated.any():
+            front.add(i)
+    return front
+
+
+class TrialStore:
+    """Compressed, content-deduplicated archive of the flow trees of finished trials.
+
+    Every file is kept once per content as blobs/<sha256>.zst or .gz, with the
+    codec recorded in store.json when the store is created: zstd if the
+    zstandard package is installed, else gzip, or the codec asked for. A
+    process without zstandard writes gzip blobs into a zstd store, and fails
+    with CodecUnavailable reading its zstd blobs. trials/<trial>.json lists a
+    trial's files and final result. When the blobs exceed max_bytes, trials off the Pareto front of
+    objectives are evicted, those without a final result and then the oldest
+    first. Eviction keeps a trial's metric JSONs and manifest, so its results
+    stay queryable. Many processes can share one store.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        objectives=None,
+        codec: str = None,
+    ) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objectives = objectives or DEFAULT_OBJECTIVES
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(root, "trials"), exist_ok=True)
+        os.makedirs(os.path.join(root, "pending"), exist_ok=True)
+        self.codec = self._store_codec(codec or ("zstd" if zstandard else "gzip"))
+        if self.codec not in CODEC_EXT:
+            raise ValueError(f"unknown trial store codec {self.codec}")
+
+    def _store_codec(self, codec: str) -> str:
+        """The codec in store.json, recording codec there for a new store."""
+        path = os.path.join(self.root, "store.json")
+        with self._lock():
+            try:
+                with open(path) as f:
+                    return json.load(f)["codec"]
+            except (OSError, ValueError, KeyError):
+                pass
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({"codec": codec}, f)
+            os.replace(tmp, path)
+            return codec
+
+    def _lock(self):
+        f = open(os.path.join(self.root, ".lock"), "w")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def _blob(self, digest: str) -> str:
+        blobs = os.path.join(self.root, "blobs")
+        for ext in (".zst", ".gz"):
+            path = os.path.join(blobs, digest + ext)
+            if os.path.isfile(path):
+                return path
+        return os.path.join(blobs, digest + CODEC_EXT[self._write_codec()])
+
+    def _write_codec(self) -> str:
+        return "gzip" if self.codec == "zstd" and zstandard is None else self.codec
+
+    def _manifest(self, trial: str) -> str:
+        return os.path.join(self.root, "trials", trial + ".json")
+
+    def _pending(self, trial_id: str) -> str:
+        return os.path.join(self.root, "pending", trial_id + ".json")
+
+    def register(self, trial_id: str, variant: str, dirs) -> None:
+        """Note the flow directories ({dir var: path}) of a running trial, which
+        archive_registered() archives as variant once the trial has ended.
+        """
+
+        with self._lock():
+            try:
+                with open(self._pending(trial_id)) as f:
+                    pending = json.load(f)
+            except (OSError, ValueError):
+                pending = {"variant": variant, "flows": []}
+            if dict(dirs) in pending["flows"]:
+                return
+            pending["flows"].append(dict(dirs))
+            tmp = self._pending(trial_id) + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(pending, f)
+            os.replace(tmp, self._pending(trial_id))
+
+    def archive_registered(self, trial_id: str, result=None) -> None:
+        """Archive the flows a trial registered with its result: the first as its
+        variant, the others as variant-1, variant-2, ...
+        """
+
+        with self._lock():
+            try:
+                with open(self._pending(trial_id)) as f:
+                    pending = json.load(f)
+            except (OSError, ValueError):
+                return
+            os.unlink(self._pending(trial_id))
+        variant = pending["variant"]
+        for i, dirs in enumerate(pending["flows"]):
+            self.archive(variant if i == 0 else f"{variant}-{i}", dirs, result)
+
+    def archive(self, trial: str, dirs, result=None, remove: bool = True) -> None:
+        """Store the files under dirs ({dir var: path}) as trial with its result.
+        The directories are removed afterwards unless remove is False.
+        """
+
+        files, paths = [], []
+        for dir_var, top in dirs.items():
+            if not os.path.isdir(top):
+                continue
+            for base, _, names in os.walk(top):
+                for name in sorted(names):
+                    path = os.path.join(base, name)
+                    if os.path.islink(path) or not os.path.isfile(path):
+                        continue
+                    digest = stage_cache.file_digest(path)
+                    rel = os.path.relpath(path, top)
+                    files.append([dir_var, rel, digest, os.path.getsize(path)])
+                    paths.append(path)
+        manifest = {
+            "trial": trial,
+            "time": time.time(),
+            "dirs": dict(dirs),
+            "result": result,
+            "evicted": False,
+            "files": files,
+        }
+        # the manifest goes first: blobs it refers to are never collected
+        with self._lock():
+            tmp = self._manifest(trial) + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(manifest, f)
+            os.replace(tmp, self._manifest(trial))
+        for (_, _, digest, _), path in zip(files, paths):
+            blob = self._blob(digest)
+            if not os.path.isfile(blob):
+                tmp = f"{blob}.tmp-{os.getpid()}"
+                _compress(path, tmp, self._write_codec())
+                os.replace(tmp, blob)
+        with self._lock():
+            self._evict()
+        if remove:
+            for top in dirs.values():
+                shutil.rmtree(top, ignore_errors=True)
+
+    def trials(self) -> dict:
+        """Manifests of all archived trials by trial id."""
+        trials = {}
+        trial_dir = os.path.join(self.root, "trials")
+        for name in os.listdir(trial_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(trial_dir, name)) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                continue
+            trials[manifest["trial"]] = manifest
+        return trials
+
+    def restore(self, trial: str, dirs=None) -> None:
+        """Write the files of a trial back, into its own directories or dirs."""
+        with open(self._manifest(trial)) as f:
+            manifest = json.load(f)
+        dirs = dirs or manifest["dirs"]
+        for dir_var, rel, digest, _ in manifest["files"]:
+            path = os.path.join(dirs[dir_var], rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _decompress(self._blob(digest), path)
+
+    def size(self) -> int:
+        blobs = os.path.join(self.root, "blobs")
+        return sum(e.stat().st_size for e in os.scandir(blobs) if e.is_file())
+
+    def evict(self) -> None:
+        """Evict dominated trials until the blobs fit in max_bytes."""
+        with self._lock():
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.size() <= self.max_bytes:
+            return
+        trials = self.trials()
+        live = [t for t in trials.values() if not t["evicted"]]
+        scored = [
+            t
+            for t in live
+            if t["result"] and all(m in t["result"] for m in self.objectives)
+        ]
+        front = {
+            scored[i]["trial"]
+            for i in pareto_front([t["result"] for t in scored], self.objectives)
+        }
+        finished = {t["trial"] for t in scored}
+        victims = sorted(
+            (t for t in live if t["trial"] not in front),
+            key=lambda t: (t["trial"] in finished, t["time"]),
+        )
+        for manifest in victims:
+            manifest["evicted"] = True
+            manifest["files"] = [
+                f for f in manifest["files"] if f[1].endswith(".json")
+            ]
+            with open(self._manifest(manifest["trial"]), "w") as f:
+                json.dump(manifest, f)
+            self._collect(trials)
+            if self.size() <= self.max_bytes:
+                return
+
+    def _collect(self, trials) -> None:
+        """Remove the blobs no trial refers to."""
+        used = {f[2] for t in trials.values() for f in t["files"]}
+        blobs = os.path.join(self.root, "blobs")
+        for entry in os.scandir(blobs):
+            digest = entry.name.split(".")[0]
+            if digest not in used and ".tmp-" not in entry.name:
+                os.unlink(entry.path)